@@ -1,22 +1,28 @@
-from typing import List
+from typing import List, Optional
 import bpy
 from .types import bl_obj_gltf_node
 from .. import gltf
 
 
-def find(obj_node: List[bl_obj_gltf_node], target: bpy.types.Object):
-    for bl_obj, node in obj_node:
-        if bl_obj == target:
-            return node
+def create_index(obj_node: List[bl_obj_gltf_node]) -> gltf.NodeIndex:
+    return gltf.NodeIndex((node for _, node in obj_node),
+                          (bl_obj for bl_obj, _ in obj_node))
+
+
+def find(index: gltf.NodeIndex, target: bpy.types.Object):
+    return index.get_by_source(target)
 
 
-def scan(obj_node: List[bl_obj_gltf_node]):
+def scan(obj_node: List[bl_obj_gltf_node],
+         index: Optional[gltf.NodeIndex] = None):
     '''
     https://docs.blender.org/api/current/bpy.types.CopyRotationConstraint.html
     '''
+    if index is None:
+        index = create_index(obj_node)
     for bl_obj, node in obj_node:
         for c in bl_obj.constraints:
             if isinstance(c, bpy.types.CopyRotationConstraint):
-                src = find(obj_node, c.target)
+                src = find(index, c.target)
                 if src:
                     node.constraint = gltf.RotationConstraint(src, c.influence)
@@ -2,53 +2,19 @@ from logging import getLogger
 
 logger = getLogger(__name__)
 
-import math
 from typing import Dict, Optional, List
+import numpy as np
 import bpy
 import mathutils
-import bmesh
 from .. import gltf
-from .mesh import create_mesh
+from .mesh import create_mesh, create_shape_keys
 from .armature import connect_bones
 from .util import disposable_mode
 
 
-def convert_obj(src: gltf.Coordinate, dst: gltf.Coordinate,
-                bl_obj: bpy.types.Object):
-    if dst == gltf.Coordinate.BLENDER_ROTATE:
-        if src == gltf.Coordinate.VRM0:
-            bl_obj.rotation_euler = (math.pi * 0.5, 0, math.pi)
-        elif src == gltf.Coordinate.VRM1:
-            bl_obj.rotation_euler = (math.pi * 0.5, 0, 0)
-        else:
-            raise NotImplementedError()
-    else:
-        raise NotImplementedError()
-
-
-def bl_traverse(bl_obj: bpy.types.Object, pred):
-    pred(bl_obj)
-
-    for child in bl_obj.children:
-        bl_traverse(child, pred)
-
-
-def set_bone_weight(bl_object, vert_idx, bone_name, weight_val):
-    if weight_val != 0.0:
-        # It can be a problem to assign weights of 0
-        # for bone index 0, if there is always 4 indices in joint_ tuple
-        if bone_name:
-            try:
-                group = bl_object.vertex_groups[bone_name]
-            except KeyError:
-                group = bl_object.vertex_groups.new(name=bone_name)
-            group.add([vert_idx], weight_val, 'ADD')
-
-
 class Importer:
-    def __init__(self, collection, conversion: gltf.Conversion):
+    def __init__(self, collection):
         self.collection = collection
-        self.conversion = conversion
         self.obj_map: Dict[gltf.Node, bpy.types.Object] = {}
         self.mesh_map: Dict[gltf.Mesh, bpy.types.Mesh] = {}
         self.skin_map: Dict[gltf.Skin, bpy.types.Object] = {}
@@ -78,6 +44,7 @@ class Importer:
                         bg = bl_obj.vertex_groups.new(name=joint.name)
                         bg.add([0], 1.0, 'ADD')
                 create_mesh(bl_mesh, node.mesh)
+                create_shape_keys(bl_obj, node.mesh)
         else:
             # empty
             bl_obj: bpy.types.Object = bpy.data.objects.new(node.name, None)
@@ -90,9 +57,11 @@ class Importer:
         if node.parent:
             bl_obj.parent = self.obj_map.get(node.parent)
 
-        # TRS
+        # TRS。座標系は Loader で変換済み
         bl_obj.location = node.translation
-        bl_obj.rotation_quaternion = node.rotation
+        bl_obj.rotation_mode = 'QUATERNION'
+        x, y, z, w = node.rotation
+        bl_obj.rotation_quaternion = (w, x, y, z)
         bl_obj.scale = node.scale
 
         return bl_obj
@@ -129,6 +98,10 @@ class Importer:
         bl_obj.select_set(True)
         bpy.ops.object.mode_set(mode='EDIT', toggle=False)
 
+        # bone の head は node の world 位置。まとめて計算する
+        nodes, matrices = gltf.node.get_world_matrices(roots)
+        heads = dict(zip(nodes, matrices[:, :3, 3].tolist()))
+
         # 1st pass: create bones
         bones: Dict[gltf.Node, bpy.types.EditBone] = {}
         for skin in skins:
@@ -141,7 +114,7 @@ class Importer:
                     continue
                 bl_bone = bl_skin.edit_bones.new(node.name)
                 # get armature local matrix
-                bl_bone.head = bl_object.matrix_world.translation
+                bl_bone.head = heads[node]
                 bl_bone.tail = bl_bone.head + mathutils.Vector((0, 0.1, 0))
                 bones[node] = bl_bone
 
@@ -222,55 +195,45 @@ class Importer:
             return
 
         logger.debug(f'skinning: {bl_object}')
-        vert_idx = [0]
-
-        def set_skinning(j, w):
-            while True:
-                try:
-                    j0, j1, j2, j3 = next(j)
-                    w0, w1, w2, w3 = next(w)
-
-                    set_bone_weight(bl_object, vert_idx[0], bone_names[j0], w0)
-                    set_bone_weight(bl_object, vert_idx[0], bone_names[j1], w1)
-                    set_bone_weight(bl_object, vert_idx[0], bone_names[j2], w2)
-                    set_bone_weight(bl_object, vert_idx[0], bone_names[j3], w3)
-                    vert_idx[0] += 1
-
-                except StopIteration:
-                    break
-
-        if mesh_node.mesh.vertices:
-            j = mesh_node.mesh.vertices.JOINTS_0()
-            w = mesh_node.mesh.vertices.WEIGHTS_0()
-            set_skinning(j, w)
-        else:
-            for sm in mesh_node.mesh.submeshes:
-                j = sm.vertices.JOINTS_0()
-                w = sm.vertices.WEIGHTS_0()
-                set_skinning(j, w)
+        vertices = mesh_node.mesh.get_vertices()
+        joints = vertices.JOINTS_0
+        weights = vertices.WEIGHTS_0
+        if joints is None or weights is None:
+            return
+
+        # (vertex, joint, weight) に展開して 0 の weight を除く
+        vertex_index = np.repeat(np.arange(vertices.vertex_count),
+                                 joints.shape[1])
+        joints = joints.reshape(-1).astype(np.int64)
+        weights = weights.reshape(-1)
+        mask = weights != 0
+        vertex_index = vertex_index[mask]
+        joints = joints[mask]
+        weights = weights[mask]
+
+        # 同じ (joint, weight) の頂点をまとめて vertex_group.add する
+        order = np.lexsort((weights, joints))
+        vertex_index = vertex_index[order]
+        joints = joints[order]
+        weights = weights[order]
+        starts = np.flatnonzero(
+            np.concatenate(([True], (joints[1:] != joints[:-1]) |
+                            (weights[1:] != weights[:-1]))))
+        for start, stop in zip(starts.tolist(),
+                               starts[1:].tolist() + [len(joints)]):
+            bone_name = bone_names[joints[start]]
+            if not bone_name:
+                continue
+            try:
+                group = bl_object.vertex_groups[bone_name]
+            except KeyError:
+                group = bl_object.vertex_groups.new(name=bone_name)
+            group.add(vertex_index[start:stop].tolist(), float(weights[start]),
+                      'ADD')
 
         modifier = bl_object.modifiers.new(name="Armature", type="ARMATURE")
         modifier.object = self.skin_map.get(skin)
 
-    def _apply_conversion(self, roots):
-        empty = bpy.data.objects.new("empty", None)
-        self.collection.objects.link(empty)
-        for bl_obj in roots:
-            bl_obj.parent = empty
-        convert_obj(self.conversion.src, self.conversion.dst, empty)
-
-        def apply(o: bpy.types.Object):
-            o.select_set(True)
-            bpy.ops.object.transform_apply(location=False,
-                                           rotation=True,
-                                           scale=False)
-            o.select_set(False)
-
-        bpy.ops.object.select_all(action='DESELECT')
-        bl_traverse(empty, apply)
-        empty.select_set(True)
-        bpy.ops.object.delete(use_global=False)
-
     def _remove_empty(self, node: gltf.Node):
         '''
         深さ優先で、深いところから順に削除する
@@ -297,9 +260,6 @@ class Importer:
             bl_obj = self._create_tree(root)
             roots.append(bl_obj)
 
-        # apply conversion
-        self._apply_conversion(roots)
-
         if loader.vrm:
             # single skin humanoid model
             pass
@@ -1,92 +1,78 @@
 import bpy
-import bmesh
+import numpy as np
 from .. import gltf
 
 UV_LAYER_NAME = 'texcoord0'
 DEFORM_LAYER_NAME = 'deform0'
 
 
-def create_vertices(bm, vertex_buffer: gltf.VertexBuffer):
-
-    deform_layer = None
-    if vertex_buffer.JOINTS_0:
-        deform_layer = bm.verts.layers.deform
-
-    for pos, n, j, w in vertex_buffer.get_vertices():
-        # position
-        vert = bm.verts.new(pos)
-        # normal
-        if n:
-            vert.normal = n
-        # bone weight
-        if deform_layer:
-            vert[deform_layer][j] = w
-
-
-def create_face(bm, mesh: gltf.Submesh):
-    for i0, i1, i2 in mesh.get_indices():
-        v0 = bm.verts[i0 + mesh.vertex_offset]
-        v1 = bm.verts[i1 + mesh.vertex_offset]
-        v2 = bm.verts[i2 + mesh.vertex_offset]
-        face = bm.faces.new((v0, v1, v2))
-        face.smooth = True  # use vertex normal
-        # face.material_index = indicesindex_to_materialindex(i)
-
-
-def get_or_create_uv_layer(bm):
-    if UV_LAYER_NAME in bm.loops.layers.uv:
-        return bm.loops.layers.uv[UV_LAYER_NAME]
-    return bm.loops.layers.uv.new(UV_LAYER_NAME)
-
-
-def set_uv(bm, uv_list):
-    uv_layer = get_or_create_uv_layer(bm)
-    for face in bm.faces:
-        for loop in face.loops:
-            uv = uv_list[loop.vert.index]
-            loop[uv_layer].uv = uv
-
-    # # Set morph target positions (no normals/tangents)
-    # for target in mesh.morphtargets:
-
-    #     layer = bm.verts.layers.shape.new(target.name)
-
-    #     for i, vert in enumerate(bm.verts):
-    #         p = target.attributes.position[i]
-    #         vert[layer] = mathutils.Vector(yup2zup(p)) + vert.co
+def set_uv(bl_mesh: bpy.types.Mesh, uv: np.ndarray, indices: np.ndarray):
+    '''
+    頂点の uv を loop ごとに展開して一度に書く
+    '''
+    uv_layer = bl_mesh.uv_layers.get(UV_LAYER_NAME)
+    if not uv_layer:
+        uv_layer = bl_mesh.uv_layers.new(name=UV_LAYER_NAME)
+    uv_layer.data.foreach_set(
+        'uv', np.ascontiguousarray(uv[indices], dtype=np.float32).reshape(-1))
+
+
+def create_shape_keys(bl_obj: bpy.types.Object, mesh: gltf.Mesh):
+    '''
+    morph target を shape key にする。差分を足した co を一度に書く
+    '''
+    targets = mesh.get_targets()
+    if not targets:
+        return
+    position = np.ascontiguousarray(mesh.get_vertices().POSITION,
+                                    dtype=np.float32)
+
+    bl_obj.shape_key_add(name='Basis')
+    for i, target in enumerate(targets):
+        bl_key = bl_obj.shape_key_add(name=mesh.get_target_name(i),
+                                      from_mix=False)
+        co = position
+        delta = target.POSITION
+        if delta is not None:
+            co = (position + delta).astype(np.float32)
+        bl_key.data.foreach_set('co', co.reshape(-1))
 
 
 def create_mesh(bl_mesh: bpy.types.Mesh, mesh: gltf.Mesh):
-    # create an empty BMesh
-    bm = bmesh.new()
-
-    uv_list = []
+    vertices = mesh.get_vertices()
+    indices = mesh.get_indices()
+    triangle_count = len(indices) // 3
 
     # vertices
-    if mesh.vertices:
-        create_vertices(bm, mesh.vertices)
-        tex = mesh.vertices.TEXCOORD_0
-        if tex:
-            for uv in tex():
-                uv_list.append(uv)
-    else:
-        for sm in mesh.submeshes:
-            create_vertices(bm, sm.vertices)
-            tex = sm.vertices.TEXCOORD_0
-            if tex:
-                for uv in tex():
-                    uv_list.append(uv)
-
-    bm.verts.ensure_lookup_table()
-    bm.verts.index_update()
+    bl_mesh.vertices.add(vertices.vertex_count)
+    bl_mesh.vertices.foreach_set(
+        'co',
+        np.ascontiguousarray(vertices.POSITION, dtype=np.float32).reshape(-1))
 
     # triangles
-    for sm in mesh.submeshes:
-        create_face(bm, sm)
+    bl_mesh.loops.add(len(indices))
+    bl_mesh.loops.foreach_set('vertex_index', indices.astype(np.int32))
+    bl_mesh.polygons.add(triangle_count)
+    bl_mesh.polygons.foreach_set(
+        'loop_start', np.arange(0, len(indices), 3, dtype=np.int32))
+    bl_mesh.polygons.foreach_set('loop_total',
+                                 np.full(triangle_count, 3, dtype=np.int32))
+    # use vertex normal
+    bl_mesh.polygons.foreach_set('use_smooth',
+                                 np.ones(triangle_count, dtype=bool))
 
     # loop layer
-    if len(uv_list) > 0:
-        set_uv(bm, uv_list)
-
-    bm.to_mesh(bl_mesh)
-    bm.free()
+    uv = vertices.get('TEXCOORD_0')
+    if uv is not None:
+        set_uv(bl_mesh, uv, indices)
+
+    bl_mesh.validate()
+    bl_mesh.update()
+
+    normal = vertices.get('NORMAL')
+    if normal is not None:
+        if hasattr(bl_mesh, 'use_auto_smooth'):
+            # before blender-4.1
+            bl_mesh.use_auto_smooth = True
+        bl_mesh.normals_split_custom_set_from_vertices(
+            np.ascontiguousarray(normal, dtype=np.float32))
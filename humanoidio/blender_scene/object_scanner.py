@@ -1,13 +1,10 @@
 from typing import List, Tuple
+import numpy as np
 import bpy, mathutils
 from .. import gltf
 from .types import bl_obj_gltf_node
 
 
-def vector2float3(v: mathutils.Vector) -> gltf.Float3:
-    return gltf.Float3(v.x, v.y, v.z)
-
-
 def vector2tuple(v: mathutils.Vector) -> Tuple[float, float, float]:
     return (v.x, v.y, v.z)
 
@@ -16,28 +13,54 @@ class BlenderObjectScanner:
     def __init__(self):
         self.nodes: List[bl_obj_gltf_node] = []
 
-    def _export_mesh(self, bm):
-        triangles: List[bmesh.types.BMLoop] = bm.calc_loop_triangles()
-        buffer = gltf.exporter.ExportMesh(len(bm.verts), len(triangles) * 3)
-
-        for i, v in enumerate(bm.verts):
-            buffer.POSITION[i] = vector2float3(v.co)
-            buffer.NORMAL[i] = vector2float3(v.normal)
-
-        i = 0
-        for t0, t1, t2 in triangles:
-            buffer.indices[i] = t0.vert.index
-            buffer.loop_normals[i] = vector2float3(t0.calc_normal())
-            buffer.check_normal(i)
-            i += 1
-            buffer.indices[i] = t1.vert.index
-            buffer.loop_normals[i] = vector2float3(t1.calc_normal())
-            buffer.check_normal(i)
-            i += 1
-            buffer.indices[i] = t2.vert.index
-            buffer.loop_normals[i] = vector2float3(t2.calc_normal())
-            buffer.check_normal(i)
-            i += 1
+    def _export_mesh(self, bl_mesh: bpy.types.Mesh):
+        bl_mesh.calc_loop_triangles()
+        if hasattr(bl_mesh, 'calc_normals_split'):
+            # before blender-4.1
+            bl_mesh.calc_normals_split()
+        buffer = gltf.exporter.ExportMesh(len(bl_mesh.vertices),
+                                          len(bl_mesh.loop_triangles) * 3)
+
+        bl_mesh.vertices.foreach_get('co', buffer.POSITION.reshape(-1))
+        bl_mesh.vertices.foreach_get('normal', buffer.NORMAL.reshape(-1))
+        indices = np.empty(len(buffer.indices), dtype=np.int32)
+        bl_mesh.loop_triangles.foreach_get('vertices', indices)
+        buffer.indices[:] = indices
+        bl_mesh.loop_triangles.foreach_get('split_normals',
+                                           buffer.loop_normals.reshape(-1))
+        buffer.check_normals()
+
+        # uv は loop ごと。glTF は v が下向き
+        uv_layer = bl_mesh.uv_layers.active
+        if uv_layer:
+            uvs = np.empty((len(bl_mesh.loops), 2), dtype=np.float32)
+            uv_layer.data.foreach_get('uv', uvs.reshape(-1))
+            loops = np.empty(len(buffer.indices), dtype=np.int32)
+            bl_mesh.loop_triangles.foreach_get('loops', loops)
+            buffer.loop_uvs = uvs[loops]
+            buffer.loop_uvs[:, 1] = 1 - buffer.loop_uvs[:, 1]
+
+        # shape key => morph target の POSITION の差分
+        if bl_mesh.shape_keys:
+            reference = bl_mesh.shape_keys.reference_key
+            base = np.empty_like(buffer.POSITION)
+            reference.data.foreach_get('co', base.reshape(-1))
+            for bl_key in bl_mesh.shape_keys.key_blocks:
+                if bl_key == reference:
+                    continue
+                co = np.empty_like(buffer.POSITION)
+                bl_key.data.foreach_get('co', co.reshape(-1))
+                buffer.targets[bl_key.name] = co - base
+
+        # material ごとに primitive を分ける
+        if len(bl_mesh.materials) > 0:
+            material_indices = np.empty(len(bl_mesh.loop_triangles),
+                                        dtype=np.int32)
+            bl_mesh.loop_triangles.foreach_get('material_index',
+                                               material_indices)
+            buffer.sort_by_material(
+                material_indices,
+                [m.name if m else None for m in bl_mesh.materials])
 
         return buffer
 
@@ -47,11 +70,7 @@ class BlenderObjectScanner:
         node.translation = vector2tuple(bl_obj.location)
 
         if isinstance(bl_obj.data, bpy.types.Mesh):
-            import bmesh
-            bm = bmesh.new()
-            bm.from_mesh(bl_obj.data)
-            node.mesh = self._export_mesh(bm)
-            bm.free()
+            node.mesh = self._export_mesh(bl_obj.data)
 
         for child in bl_obj.children:
             child_node = self._export_object(child)
@@ -1,5 +1,9 @@
 from .node import (Node, Skin, RotationConstraint)
+from .flat_scene import FlatScene
+from .transform_cache import TransformCache
+from .node_index import NodeIndex
 from .loader import (load, Mesh, Submesh, VertexBuffer, Loader)
 from .coordinate import (Coordinate, Conversion)
 from .types import Float3
 from .exporter import (AnimationChannelTargetPath, Animation)
+from .batching import (merge_static_meshes, MergeReport)
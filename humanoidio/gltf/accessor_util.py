@@ -1,61 +1,13 @@
 import ctypes
 import array
+import collections
+import hashlib
 from enum import IntEnum
-from typing import Iterable, Any, Dict, Generator, Union
+from typing import (Iterable, Any, Dict, Generator, Union, Optional, Callable,
+                    Hashable)
+import numpy as np
 from .types import Float3
-
-
-def enumerate_1(iterable) -> Generator[Any, None, None]:
-    def g():
-        for x in iterable:
-            yield x
-
-    return g
-
-
-def enumerate_2(iterable) -> Generator[Any, None, None]:
-    def g():
-        it = iter(iterable)
-        while True:
-            try:
-                _0 = next(it)
-                _1 = next(it)
-                yield (_0, _1)
-            except StopIteration:
-                break
-
-    return g
-
-
-def enumerate_3(iterable) -> Generator[Any, None, None]:
-    def g():
-        it = iter(iterable)
-        while True:
-            try:
-                _0 = next(it)
-                _1 = next(it)
-                _2 = next(it)
-                yield (_0, _1, _2)
-            except StopIteration:
-                break
-
-    return g
-
-
-def enumerate_4(iterable) -> Generator[Any, None, None]:
-    def g():
-        it = iter(iterable)
-        while True:
-            try:
-                _0 = next(it)
-                _1 = next(it)
-                _2 = next(it)
-                _3 = next(it)
-                yield (_0, _1, _2, _3)
-            except StopIteration:
-                break
-
-    return g
+from .buffer_builder import BufferBuilder
 
 
 class ComponentType(IntEnum):
@@ -93,6 +45,17 @@ CT_SIZE_MAP = {
     ComponentType.Float: 4,
 }
 
+CT_DTYPE_MAP = {
+    ComponentType.Int8: np.dtype('<i1'),
+    ComponentType.UInt8: np.dtype('<u1'),
+    ComponentType.Int16: np.dtype('<i2'),
+    ComponentType.UInt16: np.dtype('<u2'),
+    ComponentType.UInt32: np.dtype('<u4'),
+    ComponentType.Float: np.dtype('<f4'),
+}
+
+DTYPE_CT_MAP = {v: k for k, v in CT_DTYPE_MAP.items()}
+
 TYPE_SIZE_MAP = {
     "SCALAR": 1,
     "VEC2": 2,
@@ -104,15 +67,61 @@ TYPE_SIZE_MAP = {
 }
 
 
+SIZE_TYPE_MAP = {
+    1: "SCALAR",
+    2: "VEC2",
+    3: "VEC3",
+    4: "VEC4",
+    9: "MAT3",
+    16: "MAT4",
+}
+
+
+# normalized: true の整数を float にする除数。符号付きは -1 で clamp する
+NORMALIZE_MAP = {
+    ComponentType.Int8: 127.0,
+    ComponentType.UInt8: 255.0,
+    ComponentType.Int16: 32767.0,
+    ComponentType.UInt16: 65535.0,
+}
+
+
+def dequantize(values: np.ndarray, normalized: bool) -> np.ndarray:
+    '''
+    整数の accessor を float32 にする(KHR_mesh_quantization)。
+
+    normalized の場合は componentType ごとの規則で [0, 1] か [-1, 1] に写す
+    '''
+    if values.dtype == np.float32:
+        return values
+    result = values.astype(np.float32)
+    if normalized:
+        ct = DTYPE_CT_MAP[values.dtype]
+        divisor = NORMALIZE_MAP.get(ct)
+        if divisor is None:
+            raise ValueError(f'{ct.name} can not be normalized')
+        result /= divisor
+        if ct in (ComponentType.Int8, ComponentType.Int16):
+            np.maximum(result, -1.0, out=result)
+    return result
+
+
 def get_size_count(accessor):
     ct = accessor['componentType']
     t = accessor['type']
     return (CT_SIZE_MAP[ComponentType(ct)], TYPE_SIZE_MAP[t])
 
 
-def get_type_count(values: Union[memoryview, ctypes.Array, array.array]):
+def get_type_count(values: Union[memoryview, ctypes.Array, array.array,
+                                 np.ndarray]):
     if isinstance(values, memoryview):
         raise NotImplementedError()
+    elif isinstance(values, np.ndarray):
+        ct = DTYPE_CT_MAP.get(values.dtype.newbyteorder('<'))
+        if ct is None:
+            raise NotImplementedError(f'np.ndarray: {values.dtype}')
+        element_count = 1 if values.ndim == 1 else values.shape[1]
+        return ct, SIZE_TYPE_MAP[element_count]
     elif isinstance(values, ctypes.Array):
         t = values._type_
         s = ctypes.sizeof(t)
@@ -133,71 +142,328 @@ def get_type_count(values: Union[memoryview, ctypes.Array, array.array]):
         raise NotImplementedError(f'{type(values)}')
 
 
+def to_ndarray(values: Union[ctypes.Array, array.array,
+                             np.ndarray]) -> np.ndarray:
+    '''
+    push_array に渡される値を (count, element_count) の ndarray として見る
+    '''
+    t, c = get_type_count(values)
+    if isinstance(values, np.ndarray):
+        return values.reshape(len(values), TYPE_SIZE_MAP[c])
+    return np.frombuffer(values, dtype=CT_DTYPE_MAP[t]).reshape(
+        len(values), TYPE_SIZE_MAP[c])
+
+
+def get_index_dtype(max_index: int, allow_uint8: bool = True) -> np.dtype:
+    '''
+    max_index が入る最小の符号無し整数型。
+
+    各型の最大値は primitive restart と見なされるので使わない
+    '''
+    if allow_uint8 and max_index < 255:
+        return CT_DTYPE_MAP[ComponentType.UInt8]
+    elif max_index < 65535:
+        return CT_DTYPE_MAP[ComponentType.UInt16]
+    else:
+        return CT_DTYPE_MAP[ComponentType.UInt32]
+
+
+def narrow_indices(indices: Union[ctypes.Array, np.ndarray],
+                   allow_uint8: bool = True) -> np.ndarray:
+    '''
+    index buffer を入る最小の型に一度に変換する
+    '''
+    values = to_ndarray(indices).reshape(-1)
+    if len(values) == 0:
+        return values
+    dtype = get_index_dtype(int(values.max()), allow_uint8)
+    if values.dtype == dtype:
+        return values
+    return values.astype(dtype)
+
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class AccessorCache:
+    '''
+    decode 済みの accessor を LRU で保持する。
+
+    bin への view はメモリを確保しないので 0 byte として数え、
+    sparse や dequantize でコピーした分だけを max_bytes の対象にする
+    '''
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: collections.OrderedDict[
+            Hashable, np.ndarray] = collections.OrderedDict()
+
+    def __repr__(self) -> str:
+        return (f'<AccessorCache {len(self._items)} items, '
+                f'{self.nbytes}/{self.max_bytes} bytes, '
+                f'hit={self.hits}, miss={self.misses}, '
+                f'evict={self.evictions}>')
+
+    @staticmethod
+    def _cost(values: np.ndarray) -> int:
+        return values.nbytes if values.flags.owndata else 0
+
+    def get(self, key: Hashable, decode: Callable[[],
+                                                  np.ndarray]) -> np.ndarray:
+        values = self._items.get(key)
+        if values is not None:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return values
+
+        self.misses += 1
+        values = decode()
+        cost = self._cost(values)
+        if cost > self.max_bytes:
+            # 入らない
+            return values
+        self._items[key] = values
+        self.nbytes += cost
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.nbytes -= self._cost(evicted)
+            self.evictions += 1
+        return values
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
+
+
 class GltfAccessor:
-    def __init__(self, gltf: Dict[str, Any], bin: Union[bytes, bytearray]):
+    def __init__(self,
+                 gltf: Dict[str, Any],
+                 bin: Union[bytes, bytearray, memoryview, BufferBuilder],
+                 cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 dedup: bool = False):
         self.gltf = gltf
         self.bin = bin
+        self.write_buffer = None
+        # dedup: 同じ内容の bufferView / accessor を再利用する
+        self.dedup = dedup
+        self.dedup_bytes = 0
+        self.dedup_accessors = 0
+        self._bufferview_map: Dict[Hashable, int] = {}
+        self._accessor_map: Dict[Hashable, int] = {}
+        self.cache: Optional[AccessorCache] = None
         if isinstance(bin, bytearray):
+            bin = BufferBuilder(data=bin)
+            self.bin = bin
+        if isinstance(bin, BufferBuilder):
             # writeable
+            # bin への view を保持すると reserve できなくなるので cache しない
             self.write_buffer = bin
+        else:
+            self.cache = AccessorCache(cache_bytes)
 
-    def bufferview_bytes(self, index: int) -> bytes:
+    def bufferview_bytes(self, index: int) -> memoryview:
+        '''
+        bin を slice した view を返す。コピーしない
+        '''
         bufferView = self.gltf['bufferViews'][index]
         if self.bin:
-            offset = bufferView['byteOffset']
+            offset = bufferView.get('byteOffset', 0)
             length = bufferView['byteLength']
-            return self.bin[offset:offset + length]
+            if isinstance(self.bin, BufferBuilder):
+                return self.bin.getbuffer()[offset:offset + length]
+            return memoryview(self.bin)[offset:offset + length]
         else:
             raise NotImplementedError('without bin')
 
-    def accessor_generator(self, index: int) -> Generator[Any, None, None]:
+    def _bufferview_array(self, bufferView_index: int, offset: int,
+                          ct: ComponentType, element_count: int,
+                          count: int) -> np.ndarray:
+        dtype = CT_DTYPE_MAP[ct]
+        bufferView = self.gltf['bufferViews'][bufferView_index]
+        element_size = dtype.itemsize * element_count
+        stride = bufferView.get('byteStride', element_size)
+        data = self.bufferview_bytes(bufferView_index)
+        if count > 0 and offset + stride * (count - 1) + element_size > len(
+                data):
+            raise ValueError(f'bufferView[{bufferView_index}] overrun')
+        return np.ndarray((count, element_count),
+                          dtype=dtype,
+                          buffer=data,
+                          offset=offset,
+                          strides=(stride, dtype.itemsize))
+
+    def accessor_array(self, index: int) -> np.ndarray:
+        if self.cache is not None:
+            return self.cache.get(('array', index),
+                                  lambda: self._accessor_array(index))
+        return self._accessor_array(index)
+
+    def _accessor_array(self, index: int) -> np.ndarray:
+        '''
+        bufferView 上の (count, element_count) の読み取り専用 view を返す
+
+        byteStride がある場合(interleaved)は strides 付きの view になる。
+        どちらもコピーしない。
+        sparse の場合は base(無ければ 0)をコピーして値を scatter する
+        '''
         accessor = self.gltf['accessors'][index]
-        offset = accessor.get('byteOffset', 0)
-        count = accessor.get('count')
-        element_size, element_count = get_size_count(accessor)
-        data = self.bufferview_bytes(
-            accessor['bufferView'])[offset:offset +
-                                    element_size * element_count * count]
-        span = get_span(data, ComponentType(accessor['componentType']))
-        if element_count == 1:
-            return enumerate_1(span)
-        elif element_count == 2:
-            return enumerate_2(span)
-        elif element_count == 3:
-            return enumerate_3(span)
-        elif element_count == 4:
-            return enumerate_4(span)
+        count = accessor['count']
+        element_count = TYPE_SIZE_MAP[accessor['type']]
+        ct = ComponentType(accessor['componentType'])
+        if 'bufferView' in accessor:
+            values = self._bufferview_array(accessor['bufferView'],
+                                            accessor.get('byteOffset', 0), ct,
+                                            element_count, count)
         else:
-            raise NotImplementedError()
+            values = np.zeros((count, element_count), dtype=CT_DTYPE_MAP[ct])
+
+        sparse = accessor.get('sparse')
+        if sparse:
+            sparse_indices = sparse['indices']
+            indices = self._bufferview_array(
+                sparse_indices['bufferView'],
+                sparse_indices.get('byteOffset', 0),
+                ComponentType(sparse_indices['componentType']), 1,
+                sparse['count'])
+            sparse_values = sparse['values']
+            values = values.copy()
+            values[indices[:, 0]] = self._bufferview_array(
+                sparse_values['bufferView'], sparse_values.get('byteOffset', 0),
+                ct, element_count, sparse['count'])
+
+        values.flags.writeable = False
+        return values
+
+    def accessor_float_array(self, index: int) -> np.ndarray:
+        '''
+        accessor_array を float32 にして返す。float の accessor はそのまま
+        '''
+        accessor = self.gltf['accessors'][index]
+        if accessor['componentType'] == ComponentType.Float:
+            return self.accessor_array(index)
+
+        def decode():
+            values = dequantize(self.accessor_array(index),
+                                accessor.get('normalized', False))
+            values.flags.writeable = False
+            return values
+
+        if self.cache is not None:
+            return self.cache.get(('float', index), decode)
+        return decode()
 
-    def push_bytes(self, data: bytes):
-        if not isinstance(self.write_buffer, bytearray):
+    def accessor_generator(self, index: int) -> Generator[Any, None, None]:
+        '''
+        accessor_array を tuple で列挙する互換 API
+        '''
+        values = self.accessor_array(index)
+
+        def g():
+            if values.shape[1] == 1:
+                for x in values[:, 0].tolist():
+                    yield x
+            else:
+                for x in values.tolist():
+                    yield tuple(x)
+
+        return g
+
+    @staticmethod
+    def _digest(data: Union[bytes, memoryview]) -> Hashable:
+        return (hashlib.blake2b(data, digest_size=16).digest(), len(data))
+
+    def push_bytes(self,
+                   data: bytes,
+                   digest: Optional[Hashable] = None,
+                   alignment: int = 4):
+        '''
+        bufferView の先頭は alignment に揃える
+        '''
+        if not isinstance(self.write_buffer, BufferBuilder):
             raise Exception("not writable")
+        if self.dedup:
+            if digest is None:
+                digest = self._digest(data)
+            bufferView_index = self._bufferview_map.get(digest)
+            if bufferView_index is not None:
+                self.dedup_bytes += len(data)
+                return bufferView_index
+            self._bufferview_map[digest] = len(self.gltf['bufferViews'])
         bufferView_index = len(self.gltf['bufferViews'])
         bufferView = {
             'buffer': 0,
-            'byteOffset': len(self.bin),
+            'byteOffset': self.write_buffer.write(data, alignment),
             'byteLength': len(data),
         }
-        self.write_buffer.extend(data)
         self.gltf['bufferViews'].append(bufferView)
         return bufferView_index
 
-    def push_array(self, values, min_max=None) -> int:
+    def _push_sparse(self, values: np.ndarray) -> Optional[Dict[str, Any]]:
+        '''
+        0 でない要素だけを sparse で push する。
+        dense より小さくならない場合は None
+        '''
+        nonzero = np.flatnonzero(np.any(values != 0, axis=1))
+        if len(nonzero) == 0:
+            # bufferView も sparse も無い accessor は 0 で初期化される
+            return {}
+        index_dtype = get_index_dtype(nonzero[-1])
+        sparse_size = len(nonzero) * (index_dtype.itemsize +
+                                      values.itemsize * values.shape[1])
+        if sparse_size >= values.nbytes:
+            return None
+        indices = nonzero.astype(index_dtype)
+        return {
+            'count': len(nonzero),
+            'indices': {
+                'bufferView': self.push_bytes(memoryview(indices).cast('B')),
+                'componentType': DTYPE_CT_MAP[index_dtype].value,
+            },
+            'values': {
+                'bufferView':
+                self.push_bytes(
+                    memoryview(np.ascontiguousarray(
+                        values[nonzero])).cast('B')),
+            },
+        }
+
+    def push_array(self, values, min_max=False, sparse=False) -> int:
+        '''
+        min_max: 要素ごとの min / max を記録する
+        sparse: 0 の要素が多くて小さくなる場合は sparse accessor にする
+        '''
         accessor_index = len(self.gltf['accessors'])
         t, c = get_type_count(values)
+        values = to_ndarray(values)
+        data = memoryview(np.ascontiguousarray(values)).cast('B')
+        digest = None
+        if self.dedup:
+            digest = self._digest(data)
+            key = (digest, t, c, bool(min_max), bool(sparse))
+            found = self._accessor_map.get(key)
+            if found is not None:
+                self.dedup_bytes += len(data)
+                self.dedup_accessors += 1
+                return found
+            self._accessor_map[key] = accessor_index
         accessor = {
-            'bufferView': self.push_bytes(memoryview(values).cast('B')),
             'type': c,
             'componentType': t.value,
             'count': len(values)
         }
-        if min_max:
-            c = min_max()
-            for v in values:
-                c.push(v)
-            accessor['min'] = c.min
-            accessor['max'] = c.max
+        sparse_accessor = None
+        if sparse:
+            sparse_accessor = self._push_sparse(values)
+        if sparse_accessor is None:
+            accessor['bufferView'] = self.push_bytes(data, digest)
+        elif sparse_accessor:
+            accessor['sparse'] = sparse_accessor
+        if min_max and len(values) > 0:
+            accessor['min'] = values.min(axis=0).tolist()
+            accessor['max'] = values.max(axis=0).tolist()
 
         self.gltf['accessors'].append(accessor)
         return accessor_index
@@ -0,0 +1,172 @@
+'''
+draw call を減らすために、root 以下の static な mesh をひとつにまとめる。
+
+* node の transform を頂点に焼き込む
+* 同じ material の三角形をまとめて primitive を減らす
+* 元の node ごとの範囲を ExportMesh.sources に残す
+* animation する node と、その子孫はまとめない
+'''
+from typing import (List, NamedTuple, Optional, Tuple, Dict, Collection,
+                    Set)
+import numpy as np
+from .node import Node, get_world_matrices
+from .mesh import ExportMesh, ExportSubmesh, ExportSource
+from . import transform
+
+
+class MergeReport(NamedTuple):
+    mesh_count_before: int
+    mesh_count_after: int
+    draw_calls_before: int
+    draw_calls_after: int
+
+    @property
+    def draw_call_reduction(self) -> int:
+        return self.draw_calls_before - self.draw_calls_after
+
+
+def is_static(node: Node) -> bool:
+    '''
+    skinning も morph target も無い mesh
+    '''
+    mesh = node.mesh
+    return (isinstance(mesh, ExportMesh) and node.skin is None
+            and mesh.JOINTS_0 is None and not mesh.targets)
+
+
+def get_draw_calls(mesh: ExportMesh) -> int:
+    return sum(1 for sm in mesh.get_submeshes() if sm.index_count > 0)
+
+
+def root_relative_matrices(root: Node) -> Tuple[List[Node], np.ndarray]:
+    '''
+    root 以下の node と、root の座標系での行列
+    '''
+    nodes, matrices = get_world_matrices([root])
+    return nodes, np.linalg.inv(matrices[0]) @ matrices
+
+
+def merge_meshes(meshes: List[Tuple[str, ExportMesh, np.ndarray]],
+                 normal_epsilon: float = 0.0) -> ExportMesh:
+    '''
+    (名前, mesh, 行列) をひとつの mesh にする
+    '''
+    positions = []
+    normals = []
+    uvs: List[Optional[np.ndarray]] = []
+    indices = []
+    # 三角形ごとの material と source
+    triangle_materials = []
+    triangle_sources = []
+    sources: List[Tuple[str, Optional[str]]] = []
+    materials: Dict[Optional[str], int] = {}
+    vertex_offset = 0
+    for name, mesh, matrix in meshes:
+        if mesh.normal_splitted or mesh.loop_uvs is not None:
+            mesh = mesh.split(normal_epsilon)
+        positions.append(transform.transform_points(matrix, mesh.POSITION))
+        normals.append(transform.transform_normals(matrix, mesh.NORMAL))
+        uvs.append(mesh.TEXCOORD_0)
+        mesh_indices = mesh.indices.astype(np.int64).reshape(-1, 3)
+        if np.linalg.det(matrix[:3, :3]) < 0:
+            # 裏返るので三角形の向きを戻す
+            mesh_indices = mesh_indices[:, [0, 2, 1]]
+        indices.append(mesh_indices.reshape(-1) + vertex_offset)
+        vertex_offset += len(mesh.POSITION)
+        for sm in mesh.get_submeshes():
+            material = materials.setdefault(sm.material, len(materials))
+            triangle_materials.append(
+                np.full(sm.index_count // 3, material, dtype=np.int64))
+            triangle_sources.append(
+                np.full(sm.index_count // 3, len(sources), dtype=np.int64))
+            sources.append((name, sm.material))
+
+    merged_indices = np.concatenate(indices)
+    merged = ExportMesh(vertex_offset, len(merged_indices))
+    merged.POSITION[:] = np.concatenate(positions)
+    merged.NORMAL[:] = np.concatenate(normals)
+    if any(uv is not None for uv in uvs):
+        merged.TEXCOORD_0 = np.concatenate([
+            uv if uv is not None else np.zeros(
+                (len(p), 2), dtype=np.float32)
+            for uv, p in zip(uvs, positions)
+        ]).astype(np.float32)
+
+    # material ごとに並べる。同じ material の中では元の順番のまま
+    triangle_materials = np.concatenate(triangle_materials)
+    triangle_sources = np.concatenate(triangle_sources)
+    order = np.argsort(triangle_materials, kind='stable')
+    merged.indices[:] = merged_indices.reshape(-1, 3)[order].reshape(-1)
+    merged.loop_normals[:] = merged.NORMAL[merged.indices]
+
+    material_names = list(materials.keys())
+    triangle_materials = triangle_materials[order]
+    triangle_sources = triangle_sources[order]
+    merged.submeshes = [
+        ExportSubmesh(material_names[triangle_materials[start]], start * 3,
+                      (stop - start) * 3)
+        for start, stop in _runs(triangle_materials)
+    ]
+    merged.sources = [
+        ExportSource(*sources[triangle_sources[start]], start * 3,
+                     (stop - start) * 3)
+        for start, stop in _runs(triangle_sources)
+    ]
+    return merged
+
+
+def _runs(values: np.ndarray) -> List[Tuple[int, int]]:
+    '''
+    同じ値が続く [start, stop) の範囲
+    '''
+    if len(values) == 0:
+        return []
+    starts = np.flatnonzero(
+        np.concatenate(([True], values[1:] != values[:-1])))
+    return list(zip(starts.tolist(), starts[1:].tolist() + [len(values)]))
+
+
+def get_moving_nodes(root: Node, animated: Collection[Node]) -> Set[Node]:
+    '''
+    root からの相対的な transform が animation で変わる node。
+    root 自身の animation は子全体が一緒に動くので含めない
+    '''
+    moving: Set[Node] = set()
+    for node in root.traverse():
+        if node is root:
+            continue
+        if node in animated or node.parent in moving:
+            moving.add(node)
+    return moving
+
+
+def merge_static_meshes(root: Node,
+                        normal_epsilon: float = 0.0,
+                        animated: Collection[Node] = ()) -> MergeReport:
+    '''
+    root 以下の static な mesh をまとめて root (root が static でない mesh
+    を持つ場合は新しい子 node) に置く。まとめた node の mesh は None になる。
+
+    animated: TRS が animation の target になっている node
+    '''
+    nodes, matrices = root_relative_matrices(root)
+    moving = get_moving_nodes(root, animated) if animated else set()
+    statics = [(node, matrix) for node, matrix in zip(nodes, matrices)
+               if is_static(node) and node not in moving]
+    draw_calls = sum(get_draw_calls(node.mesh) for node, _ in statics)
+    if len(statics) < 2:
+        return MergeReport(len(statics), len(statics), draw_calls,
+                           draw_calls)
+
+    merged = merge_meshes([(node.name, node.mesh, matrix)
+                           for node, matrix in statics], normal_epsilon)
+    for node, _ in statics:
+        node.mesh = None
+    if root.mesh is None:
+        root.mesh = merged
+    else:
+        holder = Node(f'{root.name}.merged')
+        holder.mesh = merged
+        root.add_child(holder)
+
+    return MergeReport(len(statics), 1, draw_calls, get_draw_calls(merged))
@@ -0,0 +1,111 @@
+from typing import Optional, Union, BinaryIO
+import io
+import shutil
+import tempfile
+
+
+class BufferBuilder:
+    '''
+    export 用の bin を組み立てる。
+
+    * reserve で先に容量を確保して、memoryview の slice に直接書く。
+      確保するのは spill_threshold まで
+    * write ごとに alignment まで 0 で padding する
+    * spill_threshold を超えたら一時ファイルに逃がす
+    '''
+    def __init__(self,
+                 capacity: int = 0,
+                 spill_threshold: Optional[int] = None,
+                 data: Optional[bytearray] = None):
+        if data is None:
+            data = bytearray()
+        self._size = len(data)
+        self._buffer = data
+        self.spill_threshold = spill_threshold
+        self._file: Optional[BinaryIO] = None
+        self.reserve(capacity)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bytes__(self) -> bytes:
+        with io.BytesIO() as bs:
+            self.write_to(bs)
+            return bs.getvalue()
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    def reserve(self, capacity: int):
+        if self._file or capacity <= len(self._buffer):
+            return
+        # 足りない時は倍々で伸ばす
+        capacity = max(capacity, len(self._buffer) * 2)
+        if self.spill_threshold is not None:
+            # 超える分は一時ファイルに書くので確保しない
+            capacity = min(capacity, self.spill_threshold)
+            if capacity <= len(self._buffer):
+                return
+        # 一時的な bytes を作らずに、新しい buffer に書き込み済みの範囲を移す
+        buffer = bytearray(capacity)
+        with memoryview(self._buffer) as view:
+            buffer[:self._size] = view[:self._size]
+        self._buffer = buffer
+
+    def _spill(self):
+        self._file = tempfile.TemporaryFile()
+        with memoryview(self._buffer) as view:
+            self._file.write(view[:self._size])
+        self._buffer = bytearray()
+
+    def write(self, data: Union[bytes, bytearray, memoryview],
+              alignment: int = 4) -> int:
+        '''
+        alignment に揃えた位置に data を書いて、その offset を返す
+        '''
+        padding = (alignment - self._size % alignment) % alignment
+        offset = self._size + padding
+        end = offset + len(data)
+        if (not self._file and self.spill_threshold is not None
+                and end > self.spill_threshold):
+            self._spill()
+
+        if self._file:
+            self._file.write(bytes(padding))
+            self._file.write(data)
+        else:
+            self.reserve(end)
+            with memoryview(self._buffer) as view:
+                view[self._size:offset] = bytes(padding)
+                view[offset:end] = data
+        self._size = end
+        return offset
+
+    def getbuffer(self) -> memoryview:
+        '''
+        書き込み済みの範囲の view。保持している間は reserve できない
+        '''
+        if self._file:
+            raise NotImplementedError('spilled to file')
+        return memoryview(self._buffer)[:self._size]
+
+    def write_to(self, f: BinaryIO):
+        if self._file:
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, f, 1024 * 1024)
+            self._file.seek(0, io.SEEK_END)
+        else:
+            with memoryview(self._buffer) as view:
+                f.write(view[:self._size])
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._buffer = bytearray()
+        self._size = 0
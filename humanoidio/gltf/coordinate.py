@@ -1,5 +1,6 @@
-from typing import NamedTuple, Iterable, Any, Generator
+from typing import NamedTuple, Tuple, Optional
 from enum import IntEnum, auto
+import numpy as np
 
 
 class Coordinate(IntEnum):
@@ -35,84 +36,154 @@ class Coordinate(IntEnum):
     UNITY = LH_XYZ_right_up_forward
 
 
-def yup2zup_turn(iterable) -> Generator[Any, None, None]:
-    def g():
-        it = iter(iterable)
-        while True:
-            try:
-                _0 = next(it)
-                _1 = next(it)
-                _2 = next(it)
-                yield (-_0, _2, _1)
-            except StopIteration:
-                break
+# 意味の上の向き (right, up, forward) の単位ベクトル
+_RIGHT = (1, 0, 0)
+_LEFT = (-1, 0, 0)
+_UP = (0, 1, 0)
+_FORWARD = (0, 0, 1)
+_BACKWARD = (0, 0, -1)
 
-    return g
+# 座標系の X, Y, Z 軸がそれぞれどの向きか
+AXES = {
+    Coordinate.GLTF: (_LEFT, _UP, _FORWARD),
+    Coordinate.VRM0: (_RIGHT, _UP, _BACKWARD),
+    Coordinate.BLENDER: (_RIGHT, _FORWARD, _UP),
+    Coordinate.BLENDER_ROTATE: (_LEFT, _BACKWARD, _UP),
+    Coordinate.UNITY: (_RIGHT, _UP, _FORWARD),
+}
 
 
-def yup2zup(iterable) -> Generator[Any, None, None]:
-    def g():
-        it = iter(iterable)
-        while True:
-            try:
-                _0 = next(it)
-                _1 = next(it)
-                _2 = next(it)
-                yield (_0, -_2, _1)
-            except StopIteration:
-                break
-
-    return g
+def get_basis(coordinate: Coordinate) -> np.ndarray:
+    '''
+    座標系の値 => (right, up, forward) の 3x3。列が X, Y, Z 軸
+    '''
+    return np.array(AXES[coordinate], dtype=np.float64).T
 
 
 class Conversion(NamedTuple):
     src: Coordinate
     dst: Coordinate
 
-    def generator(self, span: Iterable[Any]) -> Generator[Any, None, None]:
-        if self.dst == Coordinate.BLENDER:
-            # [blender]
-            # Z  Y
-            # | /
-            # +--X
-            if self.src == Coordinate.GLTF:
-                # [glTF, VRM1]
-                #    Y  Z
-                #    | /
-                # X--+
-                return yup2zup_turn(span)
-            elif self.src == Coordinate.VRM0:
-                # [VRM0]
-                #    Y
-                #    |
-                #    +--X
-                #   /
-                # Z
-                return yup2zup(span)
-            else:
-                raise NotImplementedError()
-        elif self.dst == Coordinate.BLENDER_ROTATE:
-            # [blender]
-            #    z
-            #    |
-            # X--+
-            #   /
-            # y
-            if self.src == Coordinate.GLTF:
-                # [glTF, VRM1]
-                #    Y  Z
-                #    | /
-                # X--+
-                return yup2zup(span)
-            elif self.src == Coordinate.VRM0:
-                # [VRM0]
-                #    Y
-                #    |
-                #    +--X
-                #   /
-                # Z
-                return yup2zup_turn(span)
-            else:
-                raise NotImplementedError()
-        else:
-            raise NotImplementedError()
+    @property
+    def matrix(self) -> np.ndarray:
+        '''
+        src の値 => dst の値 の 3x3。各行にひとつだけ 1 か -1 がある
+        '''
+        return get_basis(self.dst).T @ get_basis(self.src)
+
+    @property
+    def is_identity(self) -> bool:
+        return np.array_equal(self.matrix, np.identity(3))
+
+    @property
+    def is_mirror(self) -> bool:
+        '''
+        右手系と左手系の変換。三角形の向きと tangent の w が反転する
+        '''
+        return np.linalg.det(self.matrix) < 0
+
+    def _axes(self) -> Tuple[np.ndarray, np.ndarray]:
+        # dst の i 軸 = sign[i] * src の permutation[i] 軸
+        m = self.matrix
+        permutation = np.argmax(np.abs(m), axis=1)
+        sign = m[np.arange(3), permutation]
+        return permutation, sign
+
+    def convert_vectors(self,
+                        values: np.ndarray,
+                        out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        (n, 3) の位置や normal。(n, 4) の場合は xyz だけ変換する。
+
+        out に values を渡すとその場で書き換える。
+        軸の入れ替えで (n, 3) の一時配列をひとつ作る
+        '''
+        permutation, sign = self._axes()
+        values = np.asarray(values)
+        if out is None:
+            out = np.array(values, copy=True)
+        elif out is not values:
+            out[...] = values
+        np.multiply(values[:, permutation],
+                    sign.astype(values.dtype),
+                    out=out[:, :3])
+        return out
+
+    def convert_tangents(self,
+                         values: np.ndarray,
+                         out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        (n, 4) の TANGENT。mirror の場合は w も反転する。
+        morph target の (n, 3) の差分には w が無い
+        '''
+        converted = self.convert_vectors(values, out)
+        if self.is_mirror and converted.shape[1] == 4:
+            np.negative(converted[:, 3], out=converted[:, 3])
+        return converted
+
+    def convert_quaternions(self,
+                            values: np.ndarray,
+                            out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        (n, 4) の (x, y, z, w)。回転軸は mirror で向きが反転する
+        '''
+        converted = self.convert_vectors(values, out)
+        if self.is_mirror:
+            np.negative(converted[:, :3], out=converted[:, :3])
+        return converted
+
+    def convert_scales(self,
+                       values: np.ndarray,
+                       out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        (n, 3)。軸を入れ替えるだけ
+        '''
+        permutation, _ = self._axes()
+        converted = np.asarray(values)[:, permutation]
+        if out is None:
+            return converted
+        out[...] = converted
+        return out
+
+    def convert_matrices(self,
+                         values: np.ndarray,
+                         out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        (n, 4, 4) の行列 (inverse bind matrix など)。M @ A @ M^T
+        '''
+        values = np.asarray(values)
+        m = np.identity(4, dtype=values.dtype)
+        m[:3, :3] = self.matrix
+        return np.matmul(m @ values, m.T, out=out)
+
+    def convert_trs(
+        self,
+        translation: np.ndarray,
+        rotation: np.ndarray,
+        scale: np.ndarray,
+        inplace: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        inplace: 渡した配列に書き戻す
+        '''
+        return (self.convert_vectors(translation,
+                                     translation if inplace else None),
+                self.convert_quaternions(rotation,
+                                         rotation if inplace else None),
+                self.convert_scales(scale, scale if inplace else None))
+
+    def convert_attribute(self,
+                          key: str,
+                          values: np.ndarray,
+                          out: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        頂点 attribute の名前に応じて変換する。向きを持たないものはそのまま
+        '''
+        if key in ('POSITION', 'NORMAL'):
+            return self.convert_vectors(values, out)
+        if key == 'TANGENT':
+            return self.convert_tangents(values, out)
+        if out is not None and out is not values:
+            out[...] = values
+            return out
+        return values
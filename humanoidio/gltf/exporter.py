@@ -1,15 +1,24 @@
-from typing import List, Dict, Any, NamedTuple
+from logging import getLogger
+from typing import (List, Dict, Any, NamedTuple, BinaryIO, Optional, Tuple,
+                    Sequence)
 from . import accessor_util
+from . import vertex_cache
+from . import simplify
+from . import geometry
+from .buffer_builder import BufferBuilder
 from .node import Node
+from .node_index import NodeIndex
 from .mesh import ExportMesh
 from . import glb
 from enum import Enum, auto
-import collections
-from .types import Float3
+import copy
+import numpy as np
+
+logger = getLogger(__name__)
 
 
 def enum_extensions_unique(gltf: Any, used=None):
-    if not used:
+    if used is None:
         used = set()
     if isinstance(gltf, dict):
         for k, v in gltf.items():
@@ -18,7 +27,6 @@ def enum_extensions_unique(gltf: Any, used=None):
                     if kk not in used:
                         yield kk
                         used.add(kk)
-                        break
             else:
                 for x in enum_extensions_unique(v, used):
                     yield x
@@ -45,42 +53,78 @@ class Animation(NamedTuple):
     values: List[Any]
 
 
-class PostionMinMax:
-    def __init__(self):
-        self.min = [float('inf'), float('inf'), float('inf')]
-        self.max = [-float('inf'), -float('inf'), -float('inf')]
-
-    def push(self, v: Float3):
-        # min
-        if v.x < self.min[0]:
-            self.min[0] = v.x
-        if v.y < self.min[1]:
-            self.min[1] = v.y
-        if v.z < self.min[2]:
-            self.min[2] = v.z
-        # max
-        if v.x > self.max[0]:
-            self.max[0] = v.x
-        if v.y > self.max[1]:
-            self.max[1] = v.y
-        if v.z > self.max[2]:
-            self.max[2] = v.z
-
-
-class FloatMinMax:
-    def __init__(self):
-        self.min = [float('inf')]
-        self.max = [-float('inf')]
-
-    def push(self, v: float):
-        if v < self.min[0]:
-            self.min[0] = v
-        if v > self.max[0]:
-            self.max[0] = v
+def plan_mesh_size(mesh: ExportMesh, export_tangents: bool = False) -> int:
+    '''
+    push_mesh で書く bin のサイズを見積もる。alignment の分も足す。
+    split で増える頂点は数えない
+    '''
+    uvs = mesh.TEXCOORD_0 if mesh.TEXCOORD_0 is not None else mesh.loop_uvs
+    arrays = [
+        mesh.POSITION, mesh.NORMAL, mesh.TANGENT, uvs, mesh.JOINTS_0,
+        mesh.WEIGHTS_0, mesh.indices
+    ] + list(mesh.targets.values())
+    size = sum(values.nbytes + 3 for values in arrays if values is not None)
+    if export_tangents and mesh.TANGENT is None and uvs is not None:
+        size += len(mesh.POSITION) * 16 + 3
+    return size
+
+
+def plan_buffer_size(nodes: List[Node],
+                     export_tangents: bool = False,
+                     lod_levels: Sequence[simplify.LodLevel] = ()) -> int:
+    '''
+    push_scene で書く mesh の bin のサイズを見積もる。
+    LOD は ratio の分だけ足す
+    '''
+    lod_scale = 1 + sum(lod.ratio for lod in lod_levels)
+    size = 0
+    for root in nodes:
+        for node in root.traverse():
+            if isinstance(node.mesh, ExportMesh):
+                size += int(
+                    plan_mesh_size(node.mesh, export_tangents) * lod_scale)
+    return size
+
+
+def push_trs(gltf_node: Dict[str, Any], node: Node):
+    '''
+    既定値でない TRS を書く
+    '''
+    if tuple(node.translation) != (0, 0, 0):
+        gltf_node['translation'] = node.translation
+    if tuple(node.rotation) != (0, 0, 0, 1):
+        gltf_node['rotation'] = node.rotation
+    if tuple(node.scale) != (1, 1, 1):
+        gltf_node['scale'] = node.scale
 
 
 class GltfWriter:
-    def __init__(self):
+    def __init__(self,
+                 dedup: bool = True,
+                 spill_threshold: Optional[int] = None,
+                 allow_uint8_indices: bool = True,
+                 optimize_vertex_cache: bool = False,
+                 normal_epsilon: float = 0.0,
+                 lod_levels: Sequence[simplify.LodLevel] = (),
+                 export_tangents: bool = False):
+        '''
+        spill_threshold: bin がこのサイズを超えたら一時ファイルに書く
+        allow_uint8_indices: index が 255 未満なら UInt8 の index にする
+        optimize_vertex_cache: push_mesh の前に三角形と頂点を並べ替える
+        normal_epsilon: split で同じとみなす normal の差
+        lod_levels: mesh ごとに簡略化した LOD を MSFT_lod で追加する
+        export_tangents: uv がある mesh に TANGENT を追加する
+        '''
+        self.export_tangents = export_tangents
+        self.normal_epsilon = normal_epsilon
+        self.allow_uint8_indices = allow_uint8_indices
+        self.optimize_vertex_cache = optimize_vertex_cache
+        # (mesh index, report)
+        self.vertex_cache_reports: List[Tuple[
+            int, vertex_cache.VertexCacheReport]] = []
+        self.lod_levels = lod_levels
+        # (mesh index, report)
+        self.lod_reports: List[Tuple[int, simplify.LodReport]] = []
         self.gltf = {
             'asset': {
                 'version': '2.0',
@@ -92,38 +136,138 @@ class GltfWriter:
             'nodes': [],
             'scenes': [],
         }
-        self.accessor = accessor_util.GltfAccessor(self.gltf, bytearray())
+        self.material_map: Dict[str, int] = {}
+        # 書いた glTF の node index
+        self.node_map: Dict[Node, int] = {}
+        self.node_index = NodeIndex([])
+        # target の node が書かれた後で source を埋める
+        self._constraints: List[Tuple[Dict[str, Any], Node]] = []
+        self.accessor = accessor_util.GltfAccessor(
+            self.gltf,
+            BufferBuilder(spill_threshold=spill_threshold),
+            dedup=dedup)
+
+    def push_material(self, name: str) -> int:
+        '''
+        同じ名前の material はひとつにする
+        '''
+        material_index = self.material_map.get(name)
+        if material_index is None:
+            if 'materials' not in self.gltf:
+                self.gltf['materials'] = []
+            material_index = len(self.gltf['materials'])
+            self.gltf['materials'].append({'name': name})
+            self.material_map[name] = material_index
+        return material_index
 
     def push_mesh(self, mesh: ExportMesh):
-        if mesh.normal_splitted:
-            mesh = mesh.split()
+        # 生成した normal / tangent を呼び出し元の mesh に書かない。
+        # 配列は置き換えるだけなので浅い copy でよい
+        mesh = copy.copy(mesh)
+        if not np.any(mesh.NORMAL) and not np.any(mesh.loop_normals):
+            # normal が無い
+            mesh.NORMAL = geometry.compute_normals(mesh.POSITION,
+                                                   mesh.indices)
+            mesh.loop_normals = mesh.NORMAL[mesh.indices]
+            mesh.normal_splitted = False
+        if mesh.normal_splitted or mesh.loop_uvs is not None:
+            mesh = mesh.split(self.normal_epsilon)
+        if (self.export_tangents and mesh.TANGENT is None
+                and mesh.TEXCOORD_0 is not None):
+            mesh.TANGENT = geometry.compute_tangents(mesh.POSITION,
+                                                     mesh.NORMAL,
+                                                     mesh.TEXCOORD_0,
+                                                     mesh.indices)
+        if self.optimize_vertex_cache:
+            mesh, report = vertex_cache.optimize(mesh)
+            self.vertex_cache_reports.append((len(self.gltf['meshes']),
+                                              report))
         gltf_mesh = {'primitives': []}
-        primitive: Dict[str, Any] = {'attributes': {}}
-        primitive['attributes']['POSITION'] = self.accessor.push_array(
-            mesh.POSITION, PostionMinMax)
-        primitive['attributes']['NORMAL'] = self.accessor.push_array(
-            mesh.NORMAL)
-        primitive['indices'] = self.accessor.push_array(mesh.indices)
-        gltf_mesh['primitives'].append(primitive)
+        # 頂点は primitive で共有する
+        attributes: Dict[str, int] = {}
+        attributes['POSITION'] = self.accessor.push_array(mesh.POSITION,
+                                                          min_max=True)
+        attributes['NORMAL'] = self.accessor.push_array(mesh.NORMAL)
+        for k in ('TANGENT', 'TEXCOORD_0', 'JOINTS_0', 'WEIGHTS_0'):
+            values = getattr(mesh, k)
+            if values is not None:
+                attributes[k] = self.accessor.push_array(values)
+        # 動く頂点が少ない morph target は sparse にする
+        targets = [{
+            'POSITION':
+            self.accessor.push_array(delta, min_max=True, sparse=True)
+        } for delta in mesh.targets.values()]
+        if targets:
+            gltf_mesh['extras'] = {'targetNames': list(mesh.targets.keys())}
+        for submesh in mesh.get_submeshes():
+            if submesh.index_count == 0:
+                continue
+            primitive: Dict[str, Any] = {'attributes': dict(attributes)}
+            if targets:
+                primitive['targets'] = targets
+            indices = mesh.indices[submesh.index_offset:submesh.index_offset +
+                                   submesh.index_count]
+            primitive['indices'] = self.accessor.push_array(
+                accessor_util.narrow_indices(indices,
+                                             self.allow_uint8_indices))
+            if submesh.material is not None:
+                primitive['material'] = self.push_material(submesh.material)
+            # merge した元の node の範囲。primitive の indices の中の offset
+            sources = [{
+                'name': source.name,
+                'indexOffset': source.index_offset - submesh.index_offset,
+                'indexCount': source.index_count,
+            } for source in mesh.sources
+                       if submesh.index_offset <= source.index_offset <
+                       submesh.index_offset + submesh.index_count]
+            if sources:
+                primitive['extras'] = {'sources': sources}
+            gltf_mesh['primitives'].append(primitive)
 
         mesh_index = len(self.gltf['meshes'])
         self.gltf['meshes'].append(gltf_mesh)
 
         return mesh_index
 
+    def _push_lods(self, node: Node, mesh_index: int) -> List[int]:
+        '''
+        LOD ごとに簡略化した mesh の node を追加する。
+        この node は scene からは参照しない
+        '''
+        lod_nodes = []
+        for level, lod in enumerate(self.lod_levels, 1):
+            lod_mesh, error = simplify.simplify(node.mesh, lod.ratio,
+                                                lod.max_error,
+                                                self.normal_epsilon)
+            self.lod_reports.append(
+                (mesh_index,
+                 simplify.LodReport(level,
+                                    len(lod_mesh.indices) // 3, error)))
+            lod_node: Dict[str, Any] = {
+                'name': f'{node.name}.lod{level}',
+                'mesh': self.push_mesh(lod_mesh),
+            }
+            push_trs(lod_node, node)
+            lod_nodes.append(len(self.gltf['nodes']))
+            self.gltf['nodes'].append(lod_node)
+        return lod_nodes
+
     def _export_node(self, node: Node):
         gltf_node: Dict[str, Any] = {'name': node.name}
         node_index = len(self.gltf['nodes'])
         self.gltf['nodes'].append(gltf_node)
+        self.node_map[node] = node_index
 
-        # TODO: TRS
-        if node.translation != (0, 0, 0):
-            gltf_node['translation'] = node.translation
+        push_trs(gltf_node, node)
 
         # mesh
         if isinstance(node.mesh, ExportMesh):
             mesh_index = self.push_mesh(node.mesh)
             gltf_node['mesh'] = mesh_index
+            if self.lod_levels:
+                gltf_node.setdefault('extensions', {})['MSFT_lod'] = {
+                    'ids': self._push_lods(node, mesh_index)
+                }
 
         # children
         for child in node.children:
@@ -134,38 +278,74 @@ class GltfWriter:
 
         # constraint
         if node.constraint:
-            src = self.nodes.index(node.constraint.target)
-            gltf_node['extensions'] = {
-                'VRMC_node_constraint': {
-                    'constraint': {
-                        'rotation': {
-                            'source': src,
-                            'weight': node.constraint.weight
-                        }
-                    }
-                }
-            }
+            self._constraints.append((gltf_node, node))
 
         return node_index
 
-    def push_scene(self, nodes: List[Node]):
+    def _push_constraints(self):
+        for gltf_node, node in self._constraints:
+            assert node.constraint
+            src = self.node_map.get(node.constraint.target)
+            if src is None:
+                # scene に含まれない node
+                continue
+            gltf_node.setdefault('extensions', {})['VRMC_node_constraint'] = {
+                'constraint': {
+                    'rotation': {
+                        'source': src,
+                        'weight': node.constraint.weight
+                    }
+                }
+            }
+        self._constraints.clear()
+
+    def push_scene(self,
+                   nodes: List[Node],
+                   node_index: Optional[NodeIndex] = None):
+        '''
+        node_index: scanner と共有する index。Animation.node はこの index。
+        無い場合は nodes を traverse した順
+        '''
         self.nodes = nodes
+        if node_index is None:
+            node_index = NodeIndex.from_roots(nodes)
+        self.node_index = node_index
+        # spill_threshold を超える分は BufferBuilder が確保しない
+        self.accessor.write_buffer.reserve(
+            len(self.accessor.bin) +
+            plan_buffer_size(nodes, self.export_tangents, self.lod_levels))
         scene = {'nodes': []}
         for node in nodes:
-            node_index = self._export_node(node)
-            scene['nodes'].append(node_index)
+            root_index = self._export_node(node)
+            scene['nodes'].append(root_index)
+        self._push_constraints()
 
         self.gltf['scenes'].append(scene)
 
+    def get_node_index(self, index: int) -> Optional[int]:
+        '''
+        node_index の index を書いた glTF の node index にする。
+        書いていない node は None
+        '''
+        if 0 <= index < len(self.node_index):
+            return self.node_map.get(self.node_index.nodes[index])
+        return None
+
     def push_animation(self, animation: Animation, fps: float):
+        node_index = self.get_node_index(animation.node)
+        if node_index is None:
+            logger.warning(f'{animation.action_name}: '
+                           f'node {animation.node} is not exported')
+            return
         if 'animations' not in self.gltf:
             self.gltf['animations'] = []
 
-        inv = 1 / fps
-        for i, _ in enumerate(animation.times):
-            animation.times[i] = animation.times[i] * inv
+        times = np.asarray(animation.times, dtype=np.float32) / fps
+        self.accessor.write_buffer.reserve(
+            len(self.accessor.bin) + times.nbytes +
+            accessor_util.to_ndarray(animation.values).nbytes + 6)
 
-        time_accessor = self.accessor.push_array(animation.times, FloatMinMax)
+        time_accessor = self.accessor.push_array(times, min_max=True)
         values_accessor = self.accessor.push_array(animation.values)
 
         gltf_animation = {
@@ -179,14 +359,14 @@ class GltfWriter:
             "channels": [{
                 "sampler": 0,
                 "target": {
-                    "node": animation.node,
+                    "node": node_index,
                     "path": animation.target_path.name
                 }
             }],
         }
         self.gltf['animations'].append(gltf_animation)
 
-    def to_gltf(self):
+    def _finish(self) -> Dict[str, Any]:
         self.gltf['buffers'] = [{'byteLength': len(self.accessor.bin)}]
 
         # update extensions used
@@ -194,8 +374,16 @@ class GltfWriter:
             x for x in enum_extensions_unique(self.gltf)
         ]
 
-        return self.gltf, bytes(self.accessor.bin)
+        return self.gltf
+
+    def to_gltf(self):
+        return self._finish(), bytes(self.accessor.bin)
 
     def to_glb(self) -> bytes:
-        gltf, bin = self.to_gltf()
-        return glb.to_glb(gltf, bin)
+        return glb.to_glb(self._finish(), self.accessor.bin)
+
+    def write_glb(self, f: BinaryIO) -> int:
+        '''
+        BIN chunk を中間 bytes にせず f に直接書く
+        '''
+        return glb.write_glb(f, self._finish(), self.accessor.bin)
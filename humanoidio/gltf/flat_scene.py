@@ -0,0 +1,98 @@
+'''
+Node の木を配列で持つ。
+
+* 深さ順(親が先)に並べた node と親の index
+* TRS は float の配列
+* world 行列は深さごとに一度の行列積でまとめて計算する
+'''
+from typing import List, Dict, Optional, TYPE_CHECKING
+import numpy as np
+from . import transform
+if TYPE_CHECKING:
+    from .node import Node
+
+
+class FlatScene:
+    def __init__(self, roots: List['Node']):
+        nodes: List['Node'] = []
+        parents: List[int] = []
+        depths: List[int] = []
+        # 幅優先で深さ順にする
+        level = [(root, -1) for root in roots]
+        depth = 0
+        while level:
+            next_level = []
+            for node, parent in level:
+                index = len(nodes)
+                nodes.append(node)
+                parents.append(parent)
+                depths.append(depth)
+                next_level += [(child, index) for child in node.children]
+            level = next_level
+            depth += 1
+
+        self.nodes = nodes
+        self.node_index: Dict['Node', int] = {
+            node: i
+            for i, node in enumerate(nodes)
+        }
+        self.parents = np.array(parents, dtype=np.int64)
+        self.depths = np.array(depths, dtype=np.int64)
+        # depth ごとの [start, stop)
+        self.levels = np.searchsorted(self.depths,
+                                      np.arange(depth + 1)).tolist()
+        self.translation = np.zeros((len(nodes), 3), dtype=np.float64)
+        self.rotation = np.zeros((len(nodes), 4), dtype=np.float64)
+        self.scale = np.zeros((len(nodes), 3), dtype=np.float64)
+        self.pull()
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def index_of(self, node: 'Node') -> int:
+        return self.node_index[node]
+
+    def pull(self):
+        '''
+        Node の TRS を配列に読む
+        '''
+        if not self.nodes:
+            return
+        self.translation[:] = [node.translation for node in self.nodes]
+        self.rotation[:] = [node.rotation for node in self.nodes]
+        self.scale[:] = [node.scale for node in self.nodes]
+
+    def push(self):
+        '''
+        配列の TRS を Node に書き戻す
+        '''
+        for node, t, r, s in zip(self.nodes, self.translation.tolist(),
+                                 self.rotation.tolist(),
+                                 self.scale.tolist()):
+            node.translation = tuple(t)
+            node.rotation = tuple(r)
+            node.scale = tuple(s)
+
+    def local_matrices(self) -> np.ndarray:
+        return transform.trs_to_matrix(self.translation, self.rotation,
+                                       self.scale)
+
+    def world_matrices(self) -> np.ndarray:
+        '''
+        全 node の world 行列 (n, 4, 4)。深さごとに親の行列をまとめて掛ける
+        '''
+        world = self.local_matrices()
+        for start, stop in zip(self.levels[1:-1], self.levels[2:]):
+            world[start:stop] = world[self.parents[start:stop]] @ world[
+                start:stop]
+        return world
+
+    def get_matrices(self,
+                     nodes: List['Node'],
+                     world: Optional[np.ndarray] = None) -> np.ndarray:
+        '''
+        skin の joints など、指定した node の world 行列
+        '''
+        if world is None:
+            world = self.world_matrices()
+        return world[[self.node_index[node] for node in nodes]]
@@ -0,0 +1,121 @@
+'''
+頂点の normal と tangent を index から numpy でまとめて計算する
+'''
+import numpy as np
+
+
+def _scatter_add(vertex_count: int, indices: np.ndarray,
+                 values: np.ndarray) -> np.ndarray:
+    '''
+    corner ごとの (m, k) を頂点ごとに足す
+    '''
+    result = np.empty((vertex_count, values.shape[1]), dtype=np.float64)
+    for i in range(values.shape[1]):
+        result[:, i] = np.bincount(indices,
+                                   weights=values[:, i],
+                                   minlength=vertex_count)
+    return result
+
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    length = np.linalg.norm(values, axis=1, keepdims=True)
+    np.divide(values, length, out=values, where=length > 0)
+    return values
+
+
+def corner_angles(positions: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    '''
+    三角形の各 corner の角度。(triangle_count, 3)
+    '''
+    p = positions[triangles]
+    angles = np.empty(triangles.shape, dtype=np.float64)
+    for i in range(3):
+        e0 = _normalize(p[:, (i + 1) % 3] - p[:, i])
+        e1 = _normalize(p[:, (i + 2) % 3] - p[:, i])
+        angles[:, i] = np.arccos(
+            np.clip(np.einsum('ij,ij->i', e0, e1), -1, 1))
+    return angles
+
+
+def compute_normals(positions: np.ndarray,
+                    indices: np.ndarray,
+                    weighting: str = 'area') -> np.ndarray:
+    '''
+    三角形の normal を頂点に足して正規化する。
+
+    weighting: 'area' は面積、'angle' は corner の角度で重みをつける
+    '''
+    positions = np.asarray(positions, dtype=np.float64)
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    p = positions[triangles]
+    # 長さが面積の 2 倍
+    face_normals = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    if weighting == 'area':
+        corner_normals = np.repeat(face_normals, 3, axis=0)
+    elif weighting == 'angle':
+        corner_normals = (
+            _normalize(face_normals)[:, np.newaxis, :] *
+            corner_angles(positions, triangles)[:, :, np.newaxis]).reshape(
+                -1, 3)
+    else:
+        raise ValueError(f'unknown weighting: {weighting}')
+    normals = _scatter_add(len(positions), triangles.reshape(-1),
+                           corner_normals)
+    return _normalize(normals).astype(np.float32)
+
+
+def compute_tangents(positions: np.ndarray, normals: np.ndarray,
+                     uvs: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    '''
+    glTF の TANGENT (x, y, z, w)。
+
+    MikkTSpace と同じく、三角形の uv の微分から求めた tangent / bitangent を
+    corner の角度で重みをつけて頂点に足し、normal に直交させる。
+    w は bitangent = cross(normal, tangent) * w となる符号。
+    glTF の uv は v が下向きなので、MikkTSpace の bitangent は -dP/dv。
+    頂点を分けないので、uv の mirror の境界では MikkTSpace と一致しない
+    '''
+    positions = np.asarray(positions, dtype=np.float64)
+    normals = np.asarray(normals, dtype=np.float64)
+    uvs = np.asarray(uvs, dtype=np.float64)
+    triangles = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+
+    p = positions[triangles]
+    uv = uvs[triangles]
+    e1 = p[:, 1] - p[:, 0]
+    e2 = p[:, 2] - p[:, 0]
+    d1 = uv[:, 1] - uv[:, 0]
+    d2 = uv[:, 2] - uv[:, 0]
+    det = d1[:, 0] * d2[:, 1] - d2[:, 0] * d1[:, 1]
+    # uv が潰れている三角形は寄与しない
+    r = np.divide(1.0, det, out=np.zeros_like(det), where=det != 0)
+    tangent = (e1 * d2[:, 1:2] - e2 * d1[:, 1:2]) * r[:, np.newaxis]
+    bitangent = (e2 * d1[:, 0:1] - e1 * d2[:, 0:1]) * r[:, np.newaxis]
+
+    weights = corner_angles(positions, triangles)[:, :, np.newaxis]
+    corner_tangents = (_normalize(tangent)[:, np.newaxis, :] *
+                       weights).reshape(-1, 3)
+    corner_bitangents = (_normalize(bitangent)[:, np.newaxis, :] *
+                         weights).reshape(-1, 3)
+    corners = triangles.reshape(-1)
+    t = _scatter_add(len(positions), corners, corner_tangents)
+    b = _scatter_add(len(positions), corners, corner_bitangents)
+
+    # Gram-Schmidt
+    t -= normals * np.einsum('ij,ij->i', normals, t)[:, np.newaxis]
+    t = _normalize(t)
+    # 決まらない頂点は normal に直交する適当な向き
+    undefined = np.linalg.norm(t, axis=1) == 0
+    if np.any(undefined):
+        n = normals[undefined]
+        axis = np.where((np.abs(n[:, 0]) < 0.9)[:, np.newaxis], [1.0, 0, 0],
+                        [0, 1.0, 0])
+        t[undefined] = _normalize(axis - n * np.einsum('ij,ij->i', n, axis)
+                                  [:, np.newaxis])
+    w = np.where(
+        np.einsum('ij,ij->i', np.cross(normals, t), -b) < 0, -1.0, 1.0)
+
+    tangents = np.empty((len(positions), 4), dtype=np.float32)
+    tangents[:, :3] = t
+    tangents[:, 3] = w
+    return tangents
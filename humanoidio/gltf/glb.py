@@ -1,6 +1,9 @@
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, Union
+import pathlib
 import json
+import mmap
 import io
+from .buffer_builder import BufferBuilder
 
 GLB_MAGIC = int.to_bytes(0x46546C67, length=4, byteorder='little')
 GLB_VERSION = int.to_bytes(2, length=4, byteorder='little')
@@ -9,11 +12,14 @@ BIN_CHUNK_MAGIC = int.to_bytes(0x004E4942, length=4, byteorder='little')
 
 
 class ByteReader:
-    def __init__(self, data: bytes):
+    '''
+    data が memoryview の場合、read_bytes はコピーせずに view を返す
+    '''
+    def __init__(self, data: Union[bytes, memoryview]):
         self.data = data
         self.pos = 0
 
-    def read_bytes(self, read_len: int) -> bytes:
+    def read_bytes(self, read_len: int) -> Union[bytes, memoryview]:
         if self.pos + read_len > len(self.data):
             raise IndexError()
         value = self.data[self.pos:self.pos + read_len]
@@ -24,7 +30,7 @@ class ByteReader:
         value = self.read_bytes(4)
         return int.from_bytes(value, byteorder='little')
 
-    def read_chunk(self) -> Tuple[bytes, bytes]:
+    def read_chunk(self) -> Tuple[bytes, Union[bytes, memoryview]]:
         chunk_length = self.read_bytes(4)
         chunk_type = self.read_bytes(4)
         chunk_body = self.read_bytes(
@@ -32,7 +38,9 @@ class ByteReader:
         return (chunk_type, chunk_body)
 
 
-def get_glb_chunks(data: bytes) -> Tuple[bytes, bytes]:
+def get_glb_chunks(
+    data: Union[bytes, memoryview]
+) -> Tuple[Union[bytes, memoryview], Union[bytes, memoryview]]:
     reader = ByteReader(data)
 
     magic = reader.read_bytes(4)
@@ -62,6 +70,19 @@ def get_glb_chunks(data: bytes) -> Tuple[bytes, bytes]:
     return (json_chunk, bin_chunk)
 
 
+def map_glb_chunks(path: pathlib.Path) -> Tuple[bytes, memoryview]:
+    '''
+    ファイルを mmap して BIN chunk を memoryview で返す。
+
+    view が生きている間は mmap も解放されない。
+    '''
+    with path.open('rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    json_chunk, bin_chunk = get_glb_chunks(memoryview(mapped))
+    # json は小さいのでコピーして json.loads に渡す
+    return bytes(json_chunk), bin_chunk
+
+
 def get_padding_size(body_size: int):
     body_size_padding = body_size % 4
     if body_size_padding == 0:
@@ -70,38 +91,57 @@ def get_padding_size(body_size: int):
     return body_size_padding
 
 
-def write_chunk(bs: io.IOBase, magic: bytes, body: bytes):
+def write_chunk(bs: io.IOBase,
+                magic: bytes,
+                body: Union[bytes, bytearray, memoryview, BufferBuilder],
+                padding: bytes = b' '):
     body_size = len(body)
     body_size_padding = get_padding_size(body_size)
     body_size += body_size_padding
 
     bs.write(int.to_bytes(body_size, length=4, byteorder='little'))
     bs.write(magic)
-    bs.write(body)
-    for _ in range(body_size_padding):
-        bs.write(b' ')
+    if isinstance(body, BufferBuilder):
+        body.write_to(bs)
+    else:
+        bs.write(body)
+    bs.write(padding * body_size_padding)
 
 
-def chunk_size_with_padding(b: bytes):
+def chunk_size_with_padding(b: Union[bytes, bytearray, memoryview,
+                                    BufferBuilder]):
     return 8 + len(b) + get_padding_size(len(b))
 
 
-def to_glb(gltf: Dict[str, Any], bin: bytes):
+def write_glb(bs: io.IOBase, gltf: Dict[str, Any],
+              bin: Union[bytes, bytearray, memoryview, BufferBuilder]) -> int:
     '''
-    each chunk must has 4byte alignment
+    chunk のサイズを先に計算して、header, JSON, BIN の順に bs に直接書く。
+
+    bin はコピーせずにそのまま write する。書き込んだ byte 数を返す
     '''
+    json_body = json.dumps(gltf).encode('utf-8')
 
-    with io.BytesIO() as bs:
-        json_body = json.dumps(gltf).encode('utf-8')
+    # header
+    bs.write(GLB_MAGIC)
+    bs.write(GLB_VERSION)
+    size = 12 + chunk_size_with_padding(json_body) + chunk_size_with_padding(
+        bin)
+    bs.write(int.to_bytes(size, length=4, byteorder='little'))
+
+    write_chunk(bs, JSON_CHUNK_MAGIC, json_body)
+    # BIN chunk は 0 で padding する
+    write_chunk(bs, BIN_CHUNK_MAGIC, bin, b'\0')
+
+    return size
 
-        # header
-        bs.write(GLB_MAGIC)
-        bs.write(GLB_VERSION)
-        size = 12 + chunk_size_with_padding(
-            json_body) + chunk_size_with_padding(bin)
-        bs.write(int.to_bytes(size, length=4, byteorder='little'))
 
-        write_chunk(bs, JSON_CHUNK_MAGIC, json_body)
-        write_chunk(bs, BIN_CHUNK_MAGIC, bin)
+def to_glb(gltf: Dict[str, Any], bin: Union[bytes, bytearray, memoryview,
+                                             BufferBuilder]):
+    '''
+    each chunk must has 4byte alignment
+    '''
 
+    with io.BytesIO() as bs:
+        write_glb(bs, gltf, bin)
         return bs.getvalue()
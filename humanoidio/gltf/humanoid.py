@@ -76,10 +76,10 @@ class HumanoidBones(Enum):
 
     @classmethod
     def from_name(cls, name):
-        for e in HumanoidBones:
-            if e.name == name:
-                return e
-        raise ValueError(f'{name} not found')
+        try:
+            return cls[name]
+        except KeyError:
+            raise ValueError(f'{name} not found')
 
 
 SPINE = [
@@ -3,14 +3,26 @@ from logging import getLogger
 logger = getLogger(__name__)
 
 import pathlib
-from typing import Tuple, List, Union
+from typing import Tuple, List, Union, Dict
 import json
+import numpy as np
+from . import geometry
 from .mesh import (Submesh, VertexBuffer, Mesh)
-from .glb import get_glb_chunks
+from .glb import get_glb_chunks, map_glb_chunks
 from .accessor_util import GltfAccessor
 from .coordinate import (Coordinate, Conversion)
 from .node import (Node, Skin)
 from .humanoid import HumanoidBones
+from .node_index import NodeIndex
+
+
+# float として扱う attribute。量子化されている場合は float32 に戻す
+FLOAT_ATTRIBUTES = ('POSITION', 'NORMAL', 'TANGENT')
+FLOAT_ATTRIBUTE_PREFIXES = ('TEXCOORD_', 'COLOR_', 'WEIGHTS_')
+
+
+def is_float_attribute(key: str) -> bool:
+    return key in FLOAT_ATTRIBUTES or key.startswith(FLOAT_ATTRIBUTE_PREFIXES)
 
 
 class Vrm0:
@@ -28,26 +40,68 @@ class Loader:
         self.meshes: List[Mesh] = []
         self.nodes: List[Node] = []
         self.roots: List[Node] = []
+        self.node_index = NodeIndex([])
         self.vrm: Union[Vrm0, Vrm1, None] = None
 
+    def _load_vertices(self, data: GltfAccessor,
+                       attributes: Dict[str, int]) -> VertexBuffer:
+        vertices = VertexBuffer()
+        for k, v in attributes.items():
+            if is_float_attribute(k):
+                vertices.set_attribute(k, data.accessor_float_array(v))
+            else:
+                vertices.set_attribute(k, data.accessor_array(v))
+        return vertices
+
     def _load_mesh(self, data: GltfAccessor, i: int, m):
         mesh = Mesh(m.get('name', f'mesh{i}'))
 
+        # 全 primitive が同じ accessor を使う場合は頂点を共有する
+        attributes = m['primitives'][0]['attributes']
+        targets = m['primitives'][0].get('targets', [])
+        if all(prim['attributes'] == attributes
+               and prim.get('targets', []) == targets
+               for prim in m['primitives']):
+            mesh.vertices = self._load_vertices(data, attributes)
+            mesh.targets = [
+                self._load_vertices(data, target) for target in targets
+            ]
+
+        # morph target の名前。VRM-0.x は primitive の extras にある
+        mesh.target_names = m.get('extras', {}).get('targetNames') or m[
+            'primitives'][0].get('extras', {}).get('targetNames', [])
+
         index_offset = 0
         vertex_offset = 0
         for prim in m['primitives']:
             count = data.gltf['accessors'][prim['indices']]['count']
             sm = Submesh(index_offset, count)
-            sm.vertices = VertexBuffer()
-            sm.vertex_offset = vertex_offset
-            vertex_offset += data.gltf['accessors'][prim['attributes']
-                                                    ['POSITION']]['count']
             index_offset += count
+            if mesh.vertices is None:
+                sm.vertices = self._load_vertices(data, prim['attributes'])
+                sm.targets = [
+                    self._load_vertices(data, target)
+                    for target in prim.get('targets', [])
+                ]
+                sm.vertex_offset = vertex_offset
+                vertex_offset += sm.vertices.vertex_count
 
             mesh.submeshes.append(sm)
-            for k, v in prim['attributes'].items():
-                sm.vertices.set_attribute(k, data.accessor_generator(v))
-            sm.indices = data.accessor_generator(prim['indices'])
+            sm.indices = data.accessor_array(prim['indices'])
+
+        # NORMAL が無ければ作る
+        if mesh.vertices is not None:
+            if 'NORMAL' not in mesh.vertices:
+                mesh.vertices.NORMAL = geometry.compute_normals(
+                    mesh.vertices.POSITION,
+                    np.concatenate([
+                        sm.indices.reshape(-1) for sm in mesh.submeshes
+                    ]))
+        else:
+            for sm in mesh.submeshes:
+                if 'NORMAL' not in sm.vertices:
+                    sm.vertices.NORMAL = geometry.compute_normals(
+                        sm.vertices.POSITION, sm.indices)
 
         return mesh
 
@@ -66,6 +120,56 @@ class Loader:
 
         return node
 
+    def _convert_vertices(self, conversion: Conversion,
+                          vertices: VertexBuffer):
+        # accessor の配列は mmap への読み取り専用の view や、dedup / cache で
+        # 共有されたものがあるので、書き換えずに変換した配列に置き換える
+        for k in list(vertices):
+            vertices.set_attribute(
+                k, conversion.convert_attribute(k, vertices[k]))
+
+    def apply_conversion(self, conversion: Conversion):
+        '''
+        頂点と node の TRS を dst の座標系にまとめて変換する
+        '''
+        if conversion.is_identity:
+            return
+
+        # meshes に無くても node から参照している mesh は変換する。
+        # 複数の node で共有している mesh は一度だけ
+        meshes: Dict[int, Mesh] = {id(mesh): mesh for mesh in self.meshes}
+        for node in self.nodes:
+            if isinstance(node.mesh, Mesh):
+                meshes.setdefault(id(node.mesh), node.mesh)
+        for mesh in meshes.values():
+            buffers = [mesh.vertices] if mesh.vertices is not None else []
+            buffers += mesh.targets
+            for sm in mesh.submeshes:
+                if sm.vertices is not None:
+                    buffers.append(sm.vertices)
+                buffers += sm.targets
+                if conversion.is_mirror:
+                    # 三角形の向きを戻す
+                    sm.indices = sm.indices.reshape(-1, 3)[:, [0, 2, 1]]
+            for vertices in buffers:
+                self._convert_vertices(conversion, vertices)
+
+        if self.nodes:
+            # 作ったばかりの配列なので、その場で変換する
+            translation, rotation, scale = conversion.convert_trs(
+                np.array([node.translation for node in self.nodes],
+                         dtype=np.float64),
+                np.array([node.rotation for node in self.nodes],
+                         dtype=np.float64),
+                np.array([node.scale for node in self.nodes],
+                         dtype=np.float64),
+                inplace=True)
+            for node, t, r, s in zip(self.nodes, translation.tolist(),
+                                     rotation.tolist(), scale.tolist()):
+                node.translation = tuple(t)
+                node.rotation = tuple(r)
+                node.scale = tuple(s)
+
     def load(self, data: GltfAccessor):
         #
         # extensions
@@ -108,18 +212,32 @@ class Loader:
         #
         # vrm
         #
+        # node_index の index は glTF の node index と同じ
+        self.node_index = NodeIndex(self.nodes)
         if isinstance(self.vrm, Vrm0):
             for b in self.vrm.data['humanoid']['humanBones']:
-                node = self.nodes[b['node']]
-                node.humanoid_bone = HumanoidBones.from_name(b['bone'])
+                self.node_index.set_humanoid_bone(
+                    self.nodes[b['node']], HumanoidBones.from_name(b['bone']))
         elif isinstance(self.vrm, Vrm1):
             for k, b in self.vrm.data['humanoid']['humanBones'].items():
-                node = self.nodes[b['node']]
-                node.humanoid_bone = HumanoidBones.from_name(k)
+                self.node_index.set_humanoid_bone(self.nodes[b['node']],
+                                                  HumanoidBones.from_name(k))
+
+        if data.cache is not None:
+            logger.debug(f'{data.cache}')
 
 
-def load_glb(path: pathlib.Path, dst: Coordinate) -> Tuple[Loader, Conversion]:
-    json_chunk, bin_chunk = get_glb_chunks(path.read_bytes())
+def load_glb(path: pathlib.Path,
+             dst: Coordinate,
+             use_mmap: bool = True) -> Tuple[Loader, Conversion]:
+    '''
+    dst の座標系に変換済みの Loader を返す
+    '''
+    if use_mmap:
+        # BIN chunk は mmap への memoryview。accessor もこれを slice する
+        json_chunk, bin_chunk = map_glb_chunks(path)
+    else:
+        json_chunk, bin_chunk = get_glb_chunks(path.read_bytes())
     gltf = json.loads(json_chunk)
 
     data = GltfAccessor(gltf, bin_chunk)
@@ -128,7 +246,9 @@ def load_glb(path: pathlib.Path, dst: Coordinate) -> Tuple[Loader, Conversion]:
     src = Coordinate.GLTF
     if isinstance(loader.vrm, Vrm0):
         src = Coordinate.VRM0
-    return loader, Conversion(src, dst)
+    conversion = Conversion(src, dst)
+    loader.apply_conversion(conversion)
+    return loader, conversion
 
 
 def load_gltf(src: pathlib.Path,
@@ -136,8 +256,10 @@ def load_gltf(src: pathlib.Path,
     raise NotImplementedError()
 
 
-def load(src: pathlib.Path, conv: Coordinate) -> Tuple[Loader, Conversion]:
+def load(src: pathlib.Path,
+         conv: Coordinate,
+         use_mmap: bool = True) -> Tuple[Loader, Conversion]:
     if src.suffix == '.gltf':
         return load_gltf(src, conv)
     else:
-        return load_glb(src, conv)
+        return load_glb(src, conv, use_mmap)
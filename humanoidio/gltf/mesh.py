@@ -1,54 +1,94 @@
-from typing import Optional, Generator, Any
-from .types import Float3
-import ctypes
+from typing import Optional, Dict, List, Iterator, NamedTuple
+import numpy as np
+
+
+def _attribute_property(key: str):
+    def getter(self: 'VertexBuffer') -> Optional[np.ndarray]:
+        return self.attributes.get(key)
+
+    def setter(self: 'VertexBuffer', values: np.ndarray):
+        self.set_attribute(key, values)
+
+    return property(getter, setter)
 
 
 class VertexBuffer:
+    '''
+    頂点 attribute を列ごとに持つ(struct of arrays)。
+
+    attribute 名 => (vertex_count, element_count) の ndarray。
+    名前は POSITION, TEXCOORD_1, COLOR_0, JOINTS_1 など任意
+    '''
+    __slots__ = ('attributes', 'vertex_count')
+
     def __init__(self) -> None:
-        self.POSITION: Optional[Generator[Any, None, None]] = None
-        self.NORMAL: Optional[Generator[Any, None, None]] = None
-        self.TEXCOORD_0: Optional[Generator[Any, None, None]] = None
-        self.JOINTS_0: Optional[Generator[Any, None, None]] = None
-        self.WEIGHTS_0: Optional[Generator[Any, None, None]] = None
-
-    def set_attribute(self, key: str, value):
-        if key == 'POSITION':
-            self.POSITION = value
-        elif key == 'NORMAL':
-            self.NORMAL = value
-        elif key == 'TEXCOORD_0':
-            self.TEXCOORD_0 = value
-        elif key == 'JOINTS_0':
-            self.JOINTS_0 = value
-        elif key == 'WEIGHTS_0':
-            self.WEIGHTS_0 = value
-        else:
-            raise NotImplementedError()
-
-    def get_vertices(self):
-        pos = self.POSITION()
-        nom = self.NORMAL()
-
-        def ng():
-            while True:
-                yield None
-
-        joints = ng
-        if self.JOINTS_0:
-            joints = self.JOINTS_0()
-        weights = ng
-        if self.WEIGHTS_0:
-            weights = self.WEIGHTS_0()
-
-        while True:
-            try:
-                p = next(pos)
-                n = next(nom)
-                j = next(joints)
-                w = next(weights)
-                yield p, n, j, w
-            except StopIteration:
-                break
+        self.attributes: Dict[str, np.ndarray] = {}
+        self.vertex_count = 0
+
+    def __repr__(self) -> str:
+        return (f'<VertexBuffer {self.vertex_count}: '
+                f'{", ".join(self.attributes)}>')
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.attributes
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.attributes[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.attributes)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        return self.attributes.get(key)
+
+    def set_attribute(self, key: str, values: np.ndarray):
+        values = np.asarray(values)
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        if not self.attributes:
+            self.vertex_count = len(values)
+        elif len(values) != self.vertex_count:
+            raise ValueError(
+                f'{key}: {len(values)} != vertex_count {self.vertex_count}')
+        self.attributes[key] = values
+
+    POSITION = _attribute_property('POSITION')
+    NORMAL = _attribute_property('NORMAL')
+    TEXCOORD_0 = _attribute_property('TEXCOORD_0')
+    JOINTS_0 = _attribute_property('JOINTS_0')
+    WEIGHTS_0 = _attribute_property('WEIGHTS_0')
+
+    def slice(self, start: int, stop: int) -> 'VertexBuffer':
+        '''
+        [start, stop) の頂点の view
+        '''
+        sliced = VertexBuffer()
+        for k, v in self.attributes.items():
+            sliced.set_attribute(k, v[start:stop])
+        sliced.vertex_count = len(range(self.vertex_count)[start:stop])
+        return sliced
+
+    @staticmethod
+    def concat(buffers: List['VertexBuffer']) -> 'VertexBuffer':
+        '''
+        連結する。無い attribute は 0 で埋める
+        '''
+        if len(buffers) == 1:
+            return buffers[0]
+        templates: Dict[str, np.ndarray] = {}
+        for b in buffers:
+            for k, v in b.attributes.items():
+                templates.setdefault(k, v)
+        concatenated = VertexBuffer()
+        for k, t in templates.items():
+            concatenated.set_attribute(
+                k,
+                np.concatenate([
+                    b.attributes[k] if k in b.attributes else np.zeros(
+                        (b.vertex_count, t.shape[1]), dtype=t.dtype)
+                    for b in buffers
+                ]))
+        return concatenated
 
 
 class Submesh:
@@ -56,66 +96,299 @@ class Submesh:
         self.index_offset = index_offset
         self.index_count = index_count
         self.vertex_offset = 0
-        self.indices: Optional[Generator[Any, None, None]] = None
+        self.indices: Optional[np.ndarray] = None
         self.vertices: Optional[VertexBuffer] = None
-
-    def get_indices(self):
-        i = self.indices()
-        while True:
-            try:
-                i0 = next(i)
-                i1 = next(i)
-                i2 = next(i)
-                yield (i0, i1, i2)
-            except StopIteration:
-                break
+        # morph target ごとの差分 (POSITION, NORMAL...)
+        self.targets: List[VertexBuffer] = []
 
 
 class Mesh:
     def __init__(self, name: str):
         self.name = name
-        self.submeshes = []
+        self.submeshes: List[Submesh] = []
+        # submesh で共有する場合
         self.vertices: Optional[VertexBuffer] = None
+        self.targets: List[VertexBuffer] = []
+        self.target_names: List[str] = []
+
+    def get_target_count(self) -> int:
+        if self.vertices is not None:
+            return len(self.targets)
+        return max((len(sm.targets) for sm in self.submeshes), default=0)
+
+    def get_targets(self) -> List[VertexBuffer]:
+        '''
+        mesh 全体の morph target。submesh ごとの場合は連結する。
+        target の無い submesh は差分 0
+        '''
+        if self.vertices is not None:
+            return self.targets
+
+        def get_target(sm: Submesh, i: int) -> VertexBuffer:
+            if i < len(sm.targets):
+                return sm.targets[i]
+            empty = VertexBuffer()
+            empty.vertex_count = sm.vertices.vertex_count
+            return empty
+
+        return [
+            VertexBuffer.concat(
+                [get_target(sm, i) for sm in self.submeshes])
+            for i in range(self.get_target_count())
+        ]
+
+    def get_target_name(self, i: int) -> str:
+        if i < len(self.target_names):
+            return self.target_names[i]
+        return f'target{i}'
+
+    def get_vertices(self) -> VertexBuffer:
+        '''
+        mesh 全体の頂点。submesh ごとの場合は連結する
+        '''
+        if self.vertices is not None:
+            return self.vertices
+        return VertexBuffer.concat([sm.vertices for sm in self.submeshes])
+
+    def get_indices(self) -> np.ndarray:
+        '''
+        vertex_offset を足して連結した index
+        '''
+        return np.concatenate([
+            sm.indices.reshape(-1).astype(np.int64) + sm.vertex_offset
+            for sm in self.submeshes
+        ])
+
+
+# ExportMesh の頂点ごとの attribute
+EXPORT_VERTEX_ATTRIBUTES = ('POSITION', 'NORMAL', 'TANGENT', 'TEXCOORD_0',
+                            'JOINTS_0', 'WEIGHTS_0')
+
+
+def _as_key_bytes(values: np.ndarray) -> np.ndarray:
+    '''
+    (n, m) を行ごとの byte 列 (n, m * itemsize) にする
+    '''
+    values = np.ascontiguousarray(values)
+    row_size = values.itemsize * int(np.prod(values.shape[1:]))
+    return values.view(np.uint8).reshape(len(values), row_size)
+
+
+def _as_void_keys(columns: List[np.ndarray]) -> np.ndarray:
+    '''
+    byte 列を連結して、行ごとに比較できる 1 次元の配列にする
+    '''
+    keys = np.ascontiguousarray(np.hstack(columns))
+    return keys.view(np.dtype((np.void, keys.shape[1]))).reshape(-1)
+
+
+def _first_use_remap(first: np.ndarray) -> np.ndarray:
+    '''
+    np.unique の番号 => 最初に現れた順の番号
+    '''
+    order = np.argsort(first, kind='stable')
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    return remap
+
+
+def _float_key(values: np.ndarray, epsilon: float) -> np.ndarray:
+    if epsilon > 0:
+        return np.round(values / epsilon).astype(np.int64)
+    # -0.0 を 0.0 にそろえる
+    return values + np.float32(0)
+
+
+class ExportSubmesh(NamedTuple):
+    '''
+    同じ material の三角形の index の範囲。primitive ひとつになる
+    '''
+    material: Optional[str]
+    index_offset: int
+    index_count: int
+
+
+class ExportSource(NamedTuple):
+    '''
+    mesh を merge した場合の、元の node の submesh の index の範囲
+    '''
+    name: str
+    material: Optional[str]
+    index_offset: int
+    index_count: int
 
 
 class ExportMesh:
     def __init__(self, vertex_count: int, index_count: int):
-        self.POSITION = (Float3 * vertex_count)()
-        self.NORMAL = (Float3 * vertex_count)()
-        self.indices = (ctypes.c_uint32 * index_count)()
-        self.loop_normals = (Float3 * index_count)()
+        self.POSITION = np.zeros((vertex_count, 3), dtype=np.float32)
+        self.NORMAL = np.zeros((vertex_count, 3), dtype=np.float32)
+        self.TANGENT: Optional[np.ndarray] = None
+        self.TEXCOORD_0: Optional[np.ndarray] = None
+        self.JOINTS_0: Optional[np.ndarray] = None
+        self.WEIGHTS_0: Optional[np.ndarray] = None
+        self.indices = np.zeros(index_count, dtype=np.uint32)
+        self.loop_normals = np.zeros((index_count, 3), dtype=np.float32)
+        self.loop_uvs: Optional[np.ndarray] = None
         self.normal_splitted = False
+        # split などで作り直した場合の、元の頂点 index
+        self.source_vertices: Optional[np.ndarray] = None
+        # 空の場合は全体でひとつの primitive
+        self.submeshes: List[ExportSubmesh] = []
+        # morph target の名前 => 頂点ごとの POSITION の差分
+        self.targets: Dict[str, np.ndarray] = {}
+        # merge した場合の元の範囲。submesh の範囲の内側にある
+        self.sources: List[ExportSource] = []
+
+    def get_submeshes(self) -> List[ExportSubmesh]:
+        if self.submeshes:
+            return self.submeshes
+        return [ExportSubmesh(None, 0, len(self.indices))]
+
+    def sort_by_material(self, material_indices: np.ndarray,
+                         materials: List[Optional[str]]):
+        '''
+        三角形を material_index 順に並べ替えて、submeshes を作る。
+
+        material_indices は三角形ごと。materials は material_index => 名前
+        '''
+        material_indices = np.asarray(material_indices, dtype=np.int64)
+        order = np.argsort(material_indices, kind='stable')
+        loops = (order.reshape(-1, 1) * 3 + np.arange(3)).reshape(-1)
+        self.indices = self.indices[loops]
+        self.loop_normals = self.loop_normals[loops]
+        if self.loop_uvs is not None:
+            self.loop_uvs = self.loop_uvs[loops]
 
-    def check_normal(self, i: int):
-        if self.normal_splitted:
-            return
-        if self.NORMAL[self.indices[i]] != self.loop_normals[i]:
-            l = self.NORMAL[self.indices[i]]
-            l = (l.x, l.y, l.z)
-            r = self.loop_normals[i]
-            r = (r.x, r.y, r.z)
-            self.normal_splitted = True
-
-    def split(self) -> 'ExportMesh':
-        vertices = []
-        vertex_map = {}
-        indices = []
-        for i, n in zip(self.indices, self.loop_normals):
-            p = self.POSITION[i]
-            key = (p.x, p.y, p.z, n.x, n.y, n.z)
-            if key in vertex_map:
-                index = vertex_map[key]
-            else:
-                index = len(vertices)
-                vertices.append((p, n))
-                vertex_map[key] = index
-            indices.append(index)
-
-        splitted = ExportMesh(len(vertices), len(indices))
-        for i, (v, n) in enumerate(vertices):
-            splitted.POSITION[i] = v
-            splitted.NORMAL[i] = n
-        for i, index in enumerate(indices):
-            splitted.indices[i] = index
+        used, counts = np.unique(material_indices, return_counts=True)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1])) * 3
+        self.submeshes = [
+            ExportSubmesh(
+                materials[m] if 0 <= m < len(materials) else None, offset,
+                count * 3)
+            for m, offset, count in zip(used.tolist(), offsets.tolist(),
+                                        counts.tolist())
+        ]
 
+    def _differ_loops(self, normal_epsilon: float = 0.0) -> np.ndarray:
+        '''
+        loop normal が頂点の normal と違う loop の mask
+        '''
+        diff = np.abs(self.NORMAL[self.indices] - self.loop_normals)
+        return np.any(diff > normal_epsilon, axis=1)
+
+    def check_normals(self, normal_epsilon: float = 0.0) -> np.ndarray:
+        '''
+        全 loop を一度に比べて normal_splitted を決める。
+
+        頂点の normal と違う (split が必要な) loop の mask を返す
+        '''
+        differ = self._differ_loops(normal_epsilon)
+        self.normal_splitted = bool(np.any(differ))
+        return differ
+
+    def take(self, vertices: np.ndarray, indices: np.ndarray,
+             loops: np.ndarray) -> 'ExportMesh':
+        '''
+        vertices 番目の頂点と loops 番目の loop から新しい mesh を作る。
+        indices は新しい頂点への index。
+        loops は submesh (merge した場合は source) の範囲の中で並べ替えること
+        '''
+        taken = ExportMesh(len(vertices), len(indices))
+        for k in EXPORT_VERTEX_ATTRIBUTES:
+            values = getattr(self, k)
+            if values is not None:
+                setattr(taken, k, values[vertices])
+        taken.indices[:] = indices
+        taken.loop_normals[:] = self.loop_normals[loops]
+        if self.loop_uvs is not None:
+            taken.loop_uvs = self.loop_uvs[loops]
+        taken.normal_splitted = self.normal_splitted
+        taken.submeshes = list(self.submeshes)
+        taken.sources = list(self.sources)
+        taken.targets = {k: v[vertices] for k, v in self.targets.items()}
+        source = self.source_vertices
+        taken.source_vertices = vertices if source is None else source[
+            vertices]
+        return taken
+
+    def split(self, normal_epsilon: float = 0.0) -> 'ExportMesh':
+        '''
+        loop ごとに違う normal / uv を持つ頂点を分ける。
+
+        uv が無い場合は normal が違う loop の頂点だけを増やし、
+        それ以外の頂点はそのまま使う。
+        normal_epsilon 以下の normal の差は同じとみなす。
+        分ける loop が無ければ self を返す
+        '''
+        if self.loop_uvs is not None:
+            return self.weld(normal_epsilon)
+
+        differ = self.check_normals(normal_epsilon)
+        if not self.normal_splitted:
+            return self
+        source = self.indices.astype(np.int64)
+        loops = np.flatnonzero(differ)
+        keys = _as_void_keys([
+            _as_key_bytes(source[loops].reshape(-1, 1)),
+            _as_key_bytes(_float_key(self.loop_normals[loops],
+                                     normal_epsilon)),
+        ])
+        _, first, inverse = np.unique(keys,
+                                      return_index=True,
+                                      return_inverse=True)
+        remap = _first_use_remap(first)
+
+        # 元の頂点の後ろに、分けた頂点を足す
+        vertex_count = len(self.POSITION)
+        added = loops[first[np.argsort(first, kind='stable')]]
+        vertices = np.concatenate((np.arange(vertex_count), source[added]))
+        indices = source.copy()
+        indices[loops] = vertex_count + remap[inverse.reshape(-1)]
+        normals = np.concatenate((self.NORMAL, self.loop_normals[added]))
+
+        # 全部の loop が分かれて使われなくなった頂点を詰める
+        used = np.zeros(len(vertices), dtype=bool)
+        used[indices] = True
+        compact = np.cumsum(used) - 1
+
+        splitted = self.take(vertices[used], compact[indices],
+                             np.arange(len(source)))
+        splitted.NORMAL = normals[used]
+        splitted.normal_splitted = False
         return splitted
+
+    def weld(self, normal_epsilon: float = 0.0) -> 'ExportMesh':
+        '''
+        loop ごとの (position, normal, uv, joints, weights, morph) が同じものを
+        ひとつの頂点にまとめる。
+
+        行を byte 列にして np.unique で一度に重複を除く。
+        normal_epsilon > 0 の場合は normal をその幅で丸めて比較する
+        '''
+        source = self.indices.astype(np.int64)
+        columns = [
+            _as_key_bytes(self.POSITION[source] + np.float32(0)),
+            _as_key_bytes(_float_key(self.loop_normals, normal_epsilon)),
+        ]
+        if self.loop_uvs is not None:
+            columns.append(_as_key_bytes(self.loop_uvs + np.float32(0)))
+        for values in (self.JOINTS_0, self.WEIGHTS_0,
+                       *self.targets.values()):
+            if values is not None:
+                columns.append(_as_key_bytes(values[source]))
+        keys = _as_void_keys(columns)
+
+        _, first, inverse = np.unique(keys,
+                                      return_index=True,
+                                      return_inverse=True)
+        remap = _first_use_remap(first)
+        loops = first[np.argsort(first, kind='stable')]
+
+        welded = self.take(source[loops], remap[inverse.reshape(-1)],
+                           np.arange(len(source)))
+        welded.NORMAL = self.loop_normals[loops]
+        if self.loop_uvs is not None:
+            welded.TEXCOORD_0 = self.loop_uvs[loops]
+            welded.loop_uvs = None
+        welded.normal_splitted = False
+        return welded
@@ -1,6 +1,9 @@
 from typing import List, Optional, Tuple, Union, NamedTuple
+import numpy as np
 from .mesh import Mesh, ExportMesh
 from .humanoid import HumanoidBones
+from . import transform
+from .flat_scene import FlatScene
 
 
 class RotationConstraint(NamedTuple):
@@ -18,20 +21,94 @@ class Node:
         self.name = name
         self.children: List[Node] = []
         self.parent: Optional[Node] = None
-        self.translation: Tuple[float, float, float] = (0, 0, 0)
-        self.rotation: Tuple[float, float, float, float] = (0, 0, 0, 1)
-        self.scale: Tuple[float, float, float] = (1, 1, 1)
+        self._translation: Tuple[float, float, float] = (0, 0, 0)
+        self._rotation: Tuple[float, float, float, float] = (0, 0, 0, 1)
+        self._scale: Tuple[float, float, float] = (1, 1, 1)
+        # TransformCache が使う。None は計算しなおしが必要
+        self._local_matrix: Optional[np.ndarray] = None
+        self._world_matrix: Optional[np.ndarray] = None
+        # 子孫に world 行列が None の node がある
+        self._dirty_descendants = False
         self.mesh: Union[Mesh, ExportMesh, None] = None
         self.skin: Optional[Skin] = None
         self.humanoid_bone: Optional[HumanoidBones] = None
         self.constraint: Union[RotationConstraint, None] = None
 
+    @property
+    def translation(self) -> Tuple[float, float, float]:
+        return self._translation
+
+    @translation.setter
+    def translation(self, value: Tuple[float, float, float]):
+        self._translation = value
+        self.invalidate()
+
+    @property
+    def rotation(self) -> Tuple[float, float, float, float]:
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, value: Tuple[float, float, float, float]):
+        self._rotation = value
+        self.invalidate()
+
+    @property
+    def scale(self) -> Tuple[float, float, float]:
+        return self._scale
+
+    @scale.setter
+    def scale(self, value: Tuple[float, float, float]):
+        self._scale = value
+        self.invalidate()
+
+    def invalidate(self):
+        '''
+        TRS の変更を world 行列の cache に知らせる。
+        TRS の tuple を置き換えずに中身を書き換えたときは自分で呼ぶ
+        '''
+        self._local_matrix = None
+        self._invalidate_world()
+
+    def _invalidate_world(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            # None なら子孫も None になっている
+            if node._world_matrix is None:
+                continue
+            node._world_matrix = None
+            stack.extend(node.children)
+        parent = self.parent
+        while parent and not parent._dirty_descendants:
+            parent._dirty_descendants = True
+            parent = parent.parent
+
     def add_child(self, child: 'Node'):
         child.parent = self
         self.children.append(child)
+        child._invalidate_world()
 
     def traverse(self):
-        yield self
-        for child in self.children:
-            for x in child.traverse():
-                yield x
+        '''
+        親が先の深さ優先。再帰しない
+        '''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+
+def get_local_matrices(nodes: List[Node]) -> np.ndarray:
+    return transform.trs_to_matrix(
+        np.array([node.translation for node in nodes], dtype=np.float64),
+        np.array([node.rotation for node in nodes], dtype=np.float64),
+        np.array([node.scale for node in nodes], dtype=np.float64))
+
+
+def get_world_matrices(roots: List[Node]) -> Tuple[List[Node], np.ndarray]:
+    '''
+    roots 以下の node (traverse 順) と world 行列 (n, 4, 4)
+    '''
+    nodes = [node for root in roots for node in root.traverse()]
+    return nodes, FlatScene(roots).get_matrices(nodes)
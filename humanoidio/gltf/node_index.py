@@ -0,0 +1,66 @@
+'''
+node を identity / 名前 / humanoid bone / 元の object から O(1) で引く。
+
+export や import のたびに一度作って、scanner, writer, loader で共有する
+'''
+from typing import List, Dict, Any, Optional, Iterable
+from .node import Node
+from .humanoid import HumanoidBones
+
+
+class NodeIndex:
+    def __init__(self,
+                 nodes: Iterable[Node],
+                 sources: Optional[Iterable[Any]] = None):
+        '''
+        sources: node ごとの元の object (bpy.types.Object など)
+        '''
+        self.nodes: List[Node] = []
+        self.indices: Dict[Node, int] = {}
+        self.names: Dict[str, Node] = {}
+        self.humanoid_bones: Dict[HumanoidBones, Node] = {}
+        self.sources: Dict[Any, Node] = {}
+        for node in nodes:
+            self.add(node)
+        if sources is not None:
+            for source, node in zip(sources, self.nodes):
+                self.sources[source] = node
+
+    @staticmethod
+    def from_roots(roots: List[Node]) -> 'NodeIndex':
+        return NodeIndex(node for root in roots for node in root.traverse())
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def add(self, node: Node) -> int:
+        index = self.indices.get(node)
+        if index is not None:
+            return index
+        index = len(self.nodes)
+        self.nodes.append(node)
+        self.indices[node] = index
+        # 同名は先のものを優先する
+        self.names.setdefault(node.name, node)
+        if node.humanoid_bone:
+            self.humanoid_bones[node.humanoid_bone] = node
+        return index
+
+    def index_of(self, node: Node) -> int:
+        return self.indices[node]
+
+    def get_by_name(self, name: str) -> Optional[Node]:
+        return self.names.get(name)
+
+    def get_by_source(self, source: Any) -> Optional[Node]:
+        return self.sources.get(source)
+
+    def get_humanoid_bone(self, bone: HumanoidBones) -> Optional[Node]:
+        return self.humanoid_bones.get(bone)
+
+    def set_humanoid_bone(self, node: Node, bone: HumanoidBones):
+        if node.humanoid_bone and self.humanoid_bones.get(
+                node.humanoid_bone) is node:
+            del self.humanoid_bones[node.humanoid_bone]
+        node.humanoid_bone = bone
+        self.humanoid_bones[bone] = node
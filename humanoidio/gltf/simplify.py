@@ -0,0 +1,296 @@
+'''
+quadric error metric による mesh の簡略化(LOD 用)
+
+* Garland, Heckbert. Surface Simplification Using Quadric Error Metrics.
+  1997
+* half edge collapse。残る頂点の attribute (uv, normal, skin) はそのまま
+* 互いに影響しない collapse の組を選んで、一回り分をまとめて numpy で処理する
+* 境界、uv / normal の seam、同じ位置の頂点は動かさない
+* skinning の主な joint が違う頂点どうしは潰さない
+'''
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+from .mesh import ExportMesh, ExportSubmesh, ExportSource
+
+
+class LodLevel(NamedTuple):
+    '''
+    ratio: 元の三角形数に対する目標の割合
+    max_error: 許容する誤差(距離)。None なら ratio だけで止める
+    '''
+    ratio: float = 0.5
+    max_error: Optional[float] = None
+
+
+class LodReport(NamedTuple):
+    level: int
+    triangle_count: int
+    error: float
+
+
+# collapse の前後で三角形の normal が 60 度より回るものは裏返りとみなす
+MIN_COS = 0.5
+
+# 対称な 4x4 の quadric の (row, col)
+QUADRIC_INDICES = ((0, 0), (0, 1), (0, 2), (0, 3), (1, 1), (1, 2), (1, 3),
+                   (2, 2), (2, 3), (3, 3))
+
+
+def _triangle_normals(positions: np.ndarray,
+                      triangles: np.ndarray) -> np.ndarray:
+    p = positions[triangles]
+    return np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+
+
+def compute_quadrics(positions: np.ndarray,
+                     triangles: np.ndarray) -> np.ndarray:
+    '''
+    三角形の平面の quadric を頂点ごとに足す。(vertex_count, 10)
+    '''
+    normals = _triangle_normals(positions, triangles)
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, length, out=normals, where=length > 0)
+    planes = np.empty((len(triangles), 4), dtype=np.float64)
+    planes[:, :3] = normals
+    planes[:, 3] = -np.einsum('ij,ij->i', normals, positions[triangles[:, 0]])
+
+    corners = triangles.reshape(-1)
+    quadrics = np.empty((len(positions), len(QUADRIC_INDICES)),
+                        dtype=np.float64)
+    for i, (row, col) in enumerate(QUADRIC_INDICES):
+        quadrics[:, i] = np.bincount(corners,
+                                     weights=np.repeat(
+                                         planes[:, row] * planes[:, col], 3),
+                                     minlength=len(positions))
+    return quadrics
+
+
+def evaluate_quadrics(quadrics: np.ndarray, points: np.ndarray) -> np.ndarray:
+    '''
+    v^T Q v。v = (x, y, z, 1)
+    '''
+    x, y, z = points.T
+    q = quadrics.T
+    error = x * (q[0] * x + 2 * (q[1] * y + q[2] * z + q[3]))
+    error += y * (q[4] * y + 2 * (q[5] * z + q[6]))
+    error += z * (q[7] * z + 2 * q[8])
+    error += q[9]
+    # 丸め誤差で負にならないように
+    return np.maximum(error, 0)
+
+
+def _edge_keys(triangles: np.ndarray, vertex_count: int) -> np.ndarray:
+    '''
+    三角形の辺を (小さい方 * vertex_count + 大きい方) にする
+    '''
+    start = triangles.reshape(-1)
+    end = triangles[:, [1, 2, 0]].reshape(-1)
+    return np.minimum(start, end) * vertex_count + np.maximum(start, end)
+
+
+def find_locked_vertices(mesh: ExportMesh, triangles: np.ndarray) -> np.ndarray:
+    '''
+    動かさない頂点の mask。
+
+    split 済みの mesh では uv / normal の seam は index の上で境界になる
+    '''
+    vertex_count = len(mesh.POSITION)
+    keys, counts = np.unique(_edge_keys(triangles, vertex_count),
+                             return_counts=True)
+    border = keys[counts == 1]
+    locked = np.zeros(vertex_count, dtype=bool)
+    locked[border // vertex_count] = True
+    locked[border % vertex_count] = True
+
+    # 同じ位置に別の頂点がある
+    position = np.ascontiguousarray(mesh.POSITION + np.float32(0))
+    _, inverse, position_counts = np.unique(position.view(
+        np.dtype((np.void, position.itemsize * 3))).reshape(-1),
+                                            return_inverse=True,
+                                            return_counts=True)
+    locked |= position_counts[inverse.reshape(-1)] > 1
+    return locked
+
+
+def _dominant_joints(mesh: ExportMesh) -> Optional[np.ndarray]:
+    if mesh.JOINTS_0 is None or mesh.WEIGHTS_0 is None:
+        return None
+    dominant = np.argmax(mesh.WEIGHTS_0, axis=1)
+    return mesh.JOINTS_0[np.arange(len(dominant)), dominant]
+
+
+def _min_at(size: int, index: np.ndarray, values: np.ndarray) -> np.ndarray:
+    result = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(result, index, values)
+    return result
+
+
+def _collapse_round(positions: np.ndarray, quadrics: np.ndarray,
+                    triangles: np.ndarray, locked: np.ndarray,
+                    joints: Optional[np.ndarray], rejected: np.ndarray,
+                    max_cost: float,
+                    remove_count: int) -> Tuple[np.ndarray, np.ndarray, float]:
+    '''
+    互いに影響しない collapse をまとめて選ぶ。
+
+    (頂点の移動先, 新たに却下した edge の key, 選んだ中で最大の cost)
+    '''
+    vertex_count = len(positions)
+    remap = np.arange(vertex_count)
+    keys, face_counts = np.unique(_edge_keys(triangles, vertex_count),
+                                  return_counts=True)
+    a = keys // vertex_count
+    b = keys % vertex_count
+
+    valid = ~(locked[a] & locked[b])
+    if joints is not None:
+        valid &= joints[a] == joints[b]
+    a = a[valid]
+    b = b[valid]
+    face_counts = face_counts[valid]
+
+    # 動ける方を動かす。両方動けるなら cost の小さい方
+    merged = quadrics[a] + quadrics[b]
+    cost_ab = np.where(locked[a], np.inf, evaluate_quadrics(merged,
+                                                            positions[b]))
+    cost_ba = np.where(locked[b], np.inf, evaluate_quadrics(merged,
+                                                            positions[a]))
+    forward = cost_ab <= cost_ba
+    src = np.where(forward, a, b)
+    dst = np.where(forward, b, a)
+    cost = np.where(forward, cost_ab, cost_ba)
+
+    valid = cost <= max_cost
+    if len(rejected):
+        valid &= ~np.isin(src * vertex_count + dst, rejected)
+    candidates = np.flatnonzero(valid)
+    if len(candidates) == 0:
+        return remap, np.zeros(0, dtype=np.int64), 0.0
+    candidates = candidates[np.argsort(cost[candidates])]
+    rank = np.arange(len(candidates))
+    ca = a[candidates]
+    cb = b[candidates]
+
+    # 両端の頂点で cost が最小の edge を選ぶ。頂点を共有しない
+    vertex_rank = _min_at(vertex_count, np.concatenate((ca, cb)),
+                          np.concatenate((rank, rank)))
+    selected = rank[(vertex_rank[ca] == rank) & (vertex_rank[cb] == rank)]
+    # 動く頂点をふたつ含む三角形ができないようにする
+    csrc = src[candidates]
+    src_rank = np.full(vertex_count, np.iinfo(np.int64).max, dtype=np.int64)
+    src_rank[csrc[selected]] = selected
+    ring_rank = _min_at(vertex_count, triangles.reshape(-1),
+                        np.repeat(src_rank[triangles].min(axis=1), 3))
+    selected = selected[ring_rank[csrc[selected]] == selected]
+
+    # 目標の三角形数を越えて減らさない
+    removed = np.cumsum(face_counts[candidates[selected]])
+    selected = selected[:max(1, np.searchsorted(removed, remove_count,
+                                                side='right'))]
+    chosen = candidates[selected]
+    remap[src[chosen]] = dst[chosen]
+
+    # 裏返る三角形ができる collapse はやめる。
+    # 隣の collapse と合わせた結果で調べて、無くなるまで繰り返す
+    rejected_keys = []
+    while True:
+        moved = remap[triangles]
+        changed = np.flatnonzero(np.any(moved != triangles, axis=1))
+        changed_moved = moved[changed]
+        alive = ((changed_moved[:, 0] != changed_moved[:, 1])
+                 & (changed_moved[:, 1] != changed_moved[:, 2])
+                 & (changed_moved[:, 2] != changed_moved[:, 0]))
+        changed = changed[alive]
+        before = _triangle_normals(positions, triangles[changed])
+        after = _triangle_normals(positions, moved[changed])
+        flipped = changed[np.einsum('ij,ij->i', before, after) <= MIN_COS *
+                          np.linalg.norm(before, axis=1) *
+                          np.linalg.norm(after, axis=1)]
+        if len(flipped) == 0:
+            break
+        tri = triangles[flipped]
+        sources = np.unique(tri[remap[tri] != tri])
+        rejected_keys.append(sources * vertex_count + remap[sources])
+        remap[sources] = sources
+
+    kept = remap[src[chosen]] != src[chosen]
+    max_chosen = float(cost[chosen[kept]].max()) if np.any(kept) else 0.0
+    return remap, np.concatenate(rejected_keys + [np.zeros(0, dtype=np.int64)]), max_chosen
+
+
+def simplify(mesh: ExportMesh,
+             ratio: float = 0.5,
+             max_error: Optional[float] = None,
+             normal_epsilon: float = 0.0) -> Tuple[ExportMesh, float]:
+    '''
+    三角形数が ratio 倍になるか、誤差が max_error を越えるまで頂点を潰す。
+
+    (簡略化した mesh, 誤差) を返す。誤差は潰した頂点の quadric の平方根
+    '''
+    if mesh.normal_splitted or mesh.loop_uvs is not None:
+        mesh = mesh.split(normal_epsilon)
+    positions = mesh.POSITION.astype(np.float64)
+    triangles = mesh.indices.astype(np.int64).reshape(-1, 3)
+    # 三角形ごとの submesh (merge した mesh は source) の番号
+    ranges = mesh.sources or mesh.get_submeshes()
+    triangle_ranges = np.repeat(np.arange(len(ranges)),
+                                [r.index_count // 3 for r in ranges])
+
+    quadrics = compute_quadrics(positions, triangles)
+    locked = find_locked_vertices(mesh, triangles)
+    joints = _dominant_joints(mesh)
+    max_cost = np.inf if max_error is None else max_error * max_error
+    target = int(np.ceil(len(triangles) * ratio))
+    rejected = np.zeros(0, dtype=np.int64)
+    error = 0.0
+    while len(triangles) > target:
+        remap, rejected_keys, cost = _collapse_round(
+            positions, quadrics, triangles, locked, joints, rejected,
+            max_cost, len(triangles) - target)
+        rejected = np.concatenate((rejected, rejected_keys))
+        moved = np.flatnonzero(remap != np.arange(len(remap)))
+        if len(moved) == 0:
+            if len(rejected_keys):
+                continue
+            break
+        error = max(error, cost)
+        # 潰した頂点の quadric は移動先に足す
+        np.add.at(quadrics, remap[moved], quadrics[moved])
+
+        triangles = remap[triangles]
+        alive = ((triangles[:, 0] != triangles[:, 1])
+                 & (triangles[:, 1] != triangles[:, 2])
+                 & (triangles[:, 2] != triangles[:, 0]))
+        triangles = triangles[alive]
+        triangle_ranges = triangle_ranges[alive]
+
+    # 使っている頂点だけにする
+    vertices, indices = np.unique(triangles.reshape(-1), return_inverse=True)
+    loops = np.zeros(len(indices), dtype=np.int64)
+    simplified = mesh.take(vertices, indices.reshape(-1), loops)
+    simplified.loop_normals[:] = simplified.NORMAL[simplified.indices]
+    simplified.normal_splitted = False
+
+    # submesh の範囲を数え直す
+    counts = np.bincount(triangle_ranges, minlength=len(ranges)) * 3
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    if mesh.sources:
+        simplified.sources = [
+            ExportSource(r.name, r.material, int(offset), int(count))
+            for r, offset, count in zip(ranges, offsets, counts)
+        ]
+        simplified.submeshes = []
+        for r, offset, count in zip(ranges, offsets, counts):
+            last = simplified.submeshes[-1] if simplified.submeshes else None
+            if last and last.material == r.material:
+                simplified.submeshes[-1] = last._replace(
+                    index_count=last.index_count + int(count))
+            else:
+                simplified.submeshes.append(
+                    ExportSubmesh(r.material, int(offset), int(count)))
+    elif mesh.submeshes:
+        simplified.submeshes = [
+            ExportSubmesh(r.material, int(offset), int(count))
+            for r, offset, count in zip(ranges, offsets, counts)
+        ]
+    return simplified, float(np.sqrt(error))
@@ -0,0 +1,60 @@
+'''
+TRS と行列の計算を numpy でまとめて行う。
+
+* 行列は列ベクトル(glTF と同じ)。world = parent @ local
+* quaternion は (x, y, z, w)
+'''
+import numpy as np
+
+
+def quaternion_to_matrix(rotation: np.ndarray) -> np.ndarray:
+    '''
+    (n, 4) の quaternion => (n, 3, 3) の回転行列
+    '''
+    q = np.asarray(rotation, dtype=np.float64).reshape(-1, 4)
+    x, y, z, w = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    m = np.empty((len(q), 3, 3), dtype=np.float64)
+    m[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    m[:, 0, 1] = 2 * (x * y - z * w)
+    m[:, 0, 2] = 2 * (x * z + y * w)
+    m[:, 1, 0] = 2 * (x * y + z * w)
+    m[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    m[:, 1, 2] = 2 * (y * z - x * w)
+    m[:, 2, 0] = 2 * (x * z - y * w)
+    m[:, 2, 1] = 2 * (y * z + x * w)
+    m[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+
+def trs_to_matrix(translation: np.ndarray, rotation: np.ndarray,
+                  scale: np.ndarray) -> np.ndarray:
+    '''
+    (n, 3), (n, 4), (n, 3) => (n, 4, 4) の T @ R @ S
+    '''
+    t = np.asarray(translation, dtype=np.float64).reshape(-1, 3)
+    s = np.asarray(scale, dtype=np.float64).reshape(-1, 3)
+    m = np.zeros((len(t), 4, 4), dtype=np.float64)
+    # 列ごとに scale を掛ける
+    m[:, :3, :3] = quaternion_to_matrix(rotation) * s[:, np.newaxis, :]
+    m[:, :3, 3] = t
+    m[:, 3, 3] = 1
+    return m
+
+
+def transform_points(matrix: np.ndarray, points: np.ndarray) -> np.ndarray:
+    '''
+    (4, 4) で (n, 3) の位置を変換する
+    '''
+    matrix = np.asarray(matrix, dtype=np.float64)
+    return (points @ matrix[:3, :3].T + matrix[:3, 3]).astype(np.float32)
+
+
+def transform_normals(matrix: np.ndarray, normals: np.ndarray) -> np.ndarray:
+    '''
+    (4, 4) の逆転置で (n, 3) の normal を変換して正規化する
+    '''
+    matrix = np.asarray(matrix, dtype=np.float64)
+    transformed = normals @ np.linalg.inv(matrix[:3, :3])
+    length = np.linalg.norm(transformed, axis=1, keepdims=True)
+    np.divide(transformed, length, out=transformed, where=length > 0)
+    return transformed.astype(np.float32)
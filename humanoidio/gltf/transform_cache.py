@@ -0,0 +1,110 @@
+'''
+Node の階層に local / world 行列を持たせて、変更のあった node だけ計算しなおす。
+
+TRS を代入すると、その node の local 行列と子孫の world 行列が無効になる。
+'''
+from typing import List, Tuple
+import numpy as np
+from .node import Node, get_local_matrices
+
+IDENTITY = np.identity(4)
+
+
+class TransformCache:
+    def __init__(self):
+        self.query_count = 0
+        # 直前の query で計算しなおした数
+        self.local_count = 0
+        self.world_count = 0
+        # 累計
+        self.total_local_count = 0
+        self.total_world_count = 0
+
+    def _begin(self):
+        self.query_count += 1
+        self.local_count = 0
+        self.world_count = 0
+
+    def _update(self, levels: List[List[Node]]):
+        '''
+        levels は親が先。各 level の node の親は計算済み
+        '''
+        nodes = [node for level in levels for node in level]
+        local_nodes = [node for node in nodes if node._local_matrix is None]
+        if local_nodes:
+            for node, m in zip(local_nodes, get_local_matrices(local_nodes)):
+                node._local_matrix = m
+        for level in levels:
+            parents = np.array([
+                node.parent._world_matrix if node.parent else IDENTITY
+                for node in level
+            ])
+            local = np.array([node._local_matrix for node in level])
+            for node, m in zip(level, parents @ local):
+                node._world_matrix = m
+
+        self.local_count += len(local_nodes)
+        self.world_count += len(nodes)
+        self.total_local_count += len(local_nodes)
+        self.total_world_count += len(nodes)
+
+    def _update_ancestors(self, node: Node):
+        '''
+        node と、計算しなおしが必要な祖先だけ計算する
+        '''
+        chain = []
+        current = node
+        while current and current._world_matrix is None:
+            chain.append(current)
+            current = current.parent
+        if not chain:
+            return
+        self._update([[n] for n in reversed(chain)])
+        # chain の子孫はまだ None なので、get_world_matrices でたどれるように
+        # chain と、その祖先に印をつける
+        for n in chain:
+            if n.children:
+                n._dirty_descendants = True
+        parent = chain[-1].parent
+        while parent and not parent._dirty_descendants:
+            parent._dirty_descendants = True
+            parent = parent.parent
+
+    def get_world_matrix(self, node: Node) -> np.ndarray:
+        self._begin()
+        self._update_ancestors(node)
+        assert node._world_matrix is not None
+        return node._world_matrix
+
+    def get_world_matrices(self,
+                           roots: List[Node]) -> Tuple[List[Node], np.ndarray]:
+        '''
+        roots 以下の node (traverse 順) と world 行列 (n, 4, 4)。
+        無効になった node だけを、深さごとにまとめて計算する
+        '''
+        self._begin()
+        # roots の祖先は先に計算しておく
+        for root in roots:
+            if root.parent:
+                self._update_ancestors(root.parent)
+        levels: List[List[Node]] = []
+        level = [
+            node for node in roots
+            if node._world_matrix is None or node._dirty_descendants
+        ]
+        while level:
+            dirty = [node for node in level if node._world_matrix is None]
+            if dirty:
+                levels.append(dirty)
+            next_level = []
+            for node in level:
+                node._dirty_descendants = False
+                next_level += [
+                    child for child in node.children
+                    if child._world_matrix is None or child._dirty_descendants
+                ]
+            level = next_level
+        self._update(levels)
+
+        nodes = [node for root in roots for node in root.traverse()]
+        return nodes, np.array([node._world_matrix for node in nodes])
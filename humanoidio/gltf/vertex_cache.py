@@ -0,0 +1,173 @@
+'''
+post-transform vertex cache の最適化
+
+* Tipsify で三角形を並べ替える
+  (Sander, Nehab, Barczak. Fast Triangle Reordering for Vertex Locality
+  and Reduced Overdraw. 2007)
+* 最初に使われた順に頂点を振り直す(vertex fetch)
+* ACMR / ATVR を FIFO cache の simulation で計測する
+'''
+from typing import NamedTuple, Tuple, List
+import collections
+import numpy as np
+from .mesh import ExportMesh
+
+DEFAULT_CACHE_SIZE = 16
+
+
+class VertexCacheReport(NamedTuple):
+    '''
+    ACMR: 三角形あたりの cache miss 数。0.5 から 3.0
+    ATVR: 頂点あたりの cache miss 数。1.0 が最良
+    '''
+    acmr_before: float
+    atvr_before: float
+    acmr_after: float
+    atvr_after: float
+
+
+def count_cache_miss(indices: np.ndarray, cache_size: int) -> int:
+    '''
+    FIFO cache での頂点 shader の起動回数
+    '''
+    cache = collections.deque()
+    cached = set()
+    miss = 0
+    for i in indices.tolist():
+        if i in cached:
+            continue
+        miss += 1
+        cache.append(i)
+        cached.add(i)
+        if len(cache) > cache_size:
+            cached.discard(cache.popleft())
+    return miss
+
+
+def measure(indices: np.ndarray,
+            cache_size: int = DEFAULT_CACHE_SIZE) -> Tuple[float, float]:
+    '''
+    (ACMR, ATVR) を返す
+    '''
+    if len(indices) == 0:
+        return (0.0, 0.0)
+    miss = count_cache_miss(indices, cache_size)
+    vertex_count = len(np.unique(indices))
+    return (miss / (len(indices) // 3), miss / vertex_count)
+
+
+def tipsify(indices: np.ndarray,
+            vertex_count: int,
+            cache_size: int = DEFAULT_CACHE_SIZE) -> np.ndarray:
+    '''
+    三角形の新しい順番を返す
+    '''
+    triangles = indices.reshape(-1, 3)
+    triangle_count = len(triangles)
+
+    # 頂点 => 三角形 の adjacency を CSR で作る
+    corner_vertices = triangles.reshape(-1)
+    order = np.argsort(corner_vertices, kind='stable')
+    adjacency = (order // 3).tolist()
+    offsets = np.zeros(vertex_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(corner_vertices, minlength=vertex_count),
+              out=offsets[1:])
+    offsets = offsets.tolist()
+
+    live = np.bincount(corner_vertices, minlength=vertex_count).tolist()
+    cache_time = [0] * vertex_count
+    emitted = [False] * triangle_count
+    triangle_list = triangles.tolist()
+    dead_end: List[int] = []
+    result: List[int] = []
+    timestamp = cache_size + 1
+    cursor = 0
+
+    def skip_dead_end() -> int:
+        nonlocal cursor
+        while dead_end:
+            d = dead_end.pop()
+            if live[d] > 0:
+                return d
+        while cursor < vertex_count:
+            if live[cursor] > 0:
+                return cursor
+            cursor += 1
+        return -1
+
+    f = skip_dead_end()
+    while f >= 0:
+        candidates = []
+        for t in adjacency[offsets[f]:offsets[f + 1]]:
+            if emitted[t]:
+                continue
+            result.append(t)
+            emitted[t] = True
+            for v in triangle_list[t]:
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if timestamp - cache_time[v] > cache_size:
+                    cache_time[v] = timestamp
+                    timestamp += 1
+
+        # cache に残っていて、fan を出し切れそうな頂点を次に選ぶ
+        best = -1
+        priority = -1
+        for v in candidates:
+            if live[v] > 0:
+                p = 0
+                if timestamp - cache_time[v] + 2 * live[v] <= cache_size:
+                    p = timestamp - cache_time[v]
+                if p > priority:
+                    priority = p
+                    best = v
+        if best == -1:
+            best = skip_dead_end()
+        f = best
+
+    return np.array(result, dtype=np.int64)
+
+
+def optimize_vertex_fetch(
+        indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    index に最初に現れた順に頂点を振り直す。使われない頂点は捨てる
+
+    (新しい頂点 => 元の頂点, 新しい indices) を返す
+    '''
+    unique, first = np.unique(indices, return_index=True)
+    vertices = unique[np.argsort(first, kind='stable')]
+    remap = np.zeros(unique[-1] + 1 if len(unique) else 0, dtype=np.int64)
+    remap[vertices] = np.arange(len(vertices))
+    return vertices, remap[indices]
+
+
+def optimize(
+    mesh: ExportMesh,
+    cache_size: int = DEFAULT_CACHE_SIZE
+) -> Tuple[ExportMesh, VertexCacheReport]:
+    indices = mesh.indices.astype(np.int64)
+    acmr_before, atvr_before = measure(indices, cache_size)
+
+    # primitive ごとに描画されるので submesh の中で並べ替える。
+    # merge した mesh は元の範囲を保つ
+    ranges = mesh.sources or mesh.get_submeshes()
+    orders = [np.zeros(0, dtype=np.int64)]
+    for r in ranges:
+        # 範囲で使う頂点だけに番号を振り直して、tipsify を範囲の大きさにする
+        used, local = np.unique(indices[r.index_offset:r.index_offset +
+                                        r.index_count],
+                                return_inverse=True)
+        orders.append(
+            tipsify(local.reshape(-1), len(used), cache_size) +
+            r.index_offset // 3)
+    triangle_order = np.concatenate(orders)
+    indices = indices.reshape(-1, 3)[triangle_order].reshape(-1)
+    loops = (triangle_order.reshape(-1, 1) * 3 + np.arange(3)).reshape(-1)
+    vertices, indices = optimize_vertex_fetch(indices)
+    optimized = mesh.take(vertices, indices, loops)
+
+    acmr_after, atvr_after = measure(indices, cache_size)
+    return optimized, VertexCacheReport(acmr_before, atvr_before, acmr_after,
+                                        atvr_after)
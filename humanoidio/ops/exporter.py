@@ -9,12 +9,30 @@ from .. import blender_scene
 from .. import gltf
 import pathlib
 
+# これより大きい bin は一時ファイルに逃がす
+SPILL_THRESHOLD = 512 * 1024 * 1024
+
 
 class Exporter(bpy.types.Operator, ExportHelper):
     bl_idname = 'humanoidio.exporter'
     bl_label = 'humanoidio Exporter'
     bl_options = {'PRESET'}
 
+    optimize_vertex_cache: bpy.props.BoolProperty(  # type: ignore
+        name='Optimize Vertex Cache', default=False)
+
+    merge_static_meshes: bpy.props.BoolProperty(  # type: ignore
+        name='Merge Static Meshes', default=False)
+
+    export_tangents: bpy.props.BoolProperty(  # type: ignore
+        name='Export Tangents', default=False)
+
+    lod_count: bpy.props.IntProperty(  # type: ignore
+        name='LOD Levels', default=0, min=0, max=4)
+
+    lod_ratio: bpy.props.FloatProperty(  # type: ignore
+        name='LOD Ratio', default=0.5, min=0.01, max=1.0)
+
     def execute(self, context: bpy.types.Context):
         logger.debug('#### start ####')
 
@@ -24,19 +42,58 @@ class Exporter(bpy.types.Operator, ExportHelper):
             # export all
             bl_obj_list = bpy.context.collection.objects
         obj_node = blender_scene.object_scanner.scan(bl_obj_list)
+        # Animation.node は obj_node の index
+        node_index = blender_scene.constraint_scanner.create_index(obj_node)
         animations = blender_scene.animation_scanner.scan(obj_node)
-        constraints = blender_scene.constraint_scanner.scan(obj_node)
+        constraints = blender_scene.constraint_scanner.scan(
+            obj_node, node_index)
+
+        roots = [node for _, node in obj_node if not node.parent]
+        animated = {node_index.nodes[a.node] for a in animations}
+        if self.merge_static_meshes:
+            for root in roots:
+                report = gltf.batching.merge_static_meshes(
+                    root, animated=animated)
+                logger.debug(f'merge {root.name}: '
+                             f'{report.mesh_count_before} meshes => '
+                             f'{report.mesh_count_after}, draw calls '
+                             f'{report.draw_calls_before} => '
+                             f'{report.draw_calls_after}')
 
         # serialize
-        writer = gltf.exporter.GltfWriter()
-        writer.push_scene([node for _, node in obj_node if not node.parent])
-        for a in animations:
-            writer.push_animation(a, bpy.context.scene.render.fps)
-        glb = writer.to_glb()
-        path = pathlib.Path(self.filepath)
-
-        logger.debug(f'write {len(glb)} bytes to {path}')
-        path.write_bytes(glb)
+        writer = gltf.exporter.GltfWriter(
+            spill_threshold=SPILL_THRESHOLD,
+            optimize_vertex_cache=self.optimize_vertex_cache,
+            export_tangents=self.export_tangents,
+            lod_levels=[
+                gltf.simplify.LodLevel(self.lod_ratio**level)
+                for level in range(1, self.lod_count + 1)
+            ])
+        try:
+            writer.push_scene(roots, node_index)
+            for a in animations:
+                writer.push_animation(a, bpy.context.scene.render.fps)
+            path = pathlib.Path(self.filepath)
+            with path.open('wb') as f:
+                size = writer.write_glb(f)
+
+            logger.debug(f'write {size} bytes to {path}')
+            logger.debug(
+                f'dedup: {writer.accessor.dedup_accessors} accessors, '
+                f'{writer.accessor.dedup_bytes} bytes saved')
+            for mesh_index, report in writer.vertex_cache_reports:
+                logger.debug(f'mesh[{mesh_index}]: '
+                             f'ACMR {report.acmr_before:.3f} => '
+                             f'{report.acmr_after:.3f}, '
+                             f'ATVR {report.atvr_before:.3f} => '
+                             f'{report.atvr_after:.3f}')
+            for mesh_index, report in writer.lod_reports:
+                logger.debug(f'mesh[{mesh_index}] lod{report.level}: '
+                             f'{report.triangle_count} triangles, '
+                             f'error {report.error:.5f}')
+        finally:
+            # spill した一時ファイルを閉じる
+            writer.accessor.bin.close()
 
         return {'FINISHED'}
 
@@ -3,6 +3,7 @@ from typing import Tuple
 
 logger = getLogger(__name__)
 
+import numpy as np
 import bpy
 from bpy_extras.io_utils import ImportHelper
 import pathlib
@@ -45,65 +46,28 @@ def pmx_to_gltf(pmx: mmd.pmx_loader.Pmx) -> gltf.Loader:
     offset = 0
     mesh_node.mesh.vertices = gltf.VertexBuffer()
 
-    def pos_gen():
-        it = iter(pmx.vertices)
-        while True:
-            try:
-                v = next(it)
-                yield z_reverse(v.position.x, v.position.y, v.position.z)
-            except StopIteration:
-                break
-
-    def normal_gen():
-        it = iter(pmx.vertices)
-        while True:
-            try:
-                v = next(it)
-                yield z_reverse(v.normal.x, v.normal.y, v.normal.z)
-            except StopIteration:
-                break
-
-    def joint_gen():
-        it = iter(pmx.vertices)
-        while True:
-            try:
-                v = next(it)
-                yield (int(v.bone.x), int(v.bone.y), int(v.bone.z),
-                       int(v.bone.w))
-            except StopIteration:
-                break
-
-    def weight_gen():
-        it = iter(pmx.vertices)
-        while True:
-            try:
-                v = next(it)
-                yield (v.weight.x, v.weight.y, v.weight.z, v.weight.w)
-            except StopIteration:
-                break
-
-    mesh_node.mesh.vertices.POSITION = pos_gen
-    mesh_node.mesh.vertices.NORMAL = normal_gen
-    mesh_node.mesh.vertices.JOINTS_0 = joint_gen
-    mesh_node.mesh.vertices.WEIGHTS_0 = weight_gen
-
-    it = iter(pmx.indices)
+    # Vertex4BoneWeights: position(3), normal(3), uv(2), bone(4), weight(4)
+    vertices = np.frombuffer(pmx.vertices, dtype=np.float32).reshape(-1, 16)
+    position = vertices[:, 0:3].copy()
+    position[:, 2] *= -1
+    normal = vertices[:, 3:6].copy()
+    normal[:, 2] *= -1
+    mesh_node.mesh.vertices.set_attribute('POSITION', position)
+    mesh_node.mesh.vertices.set_attribute('NORMAL', normal)
+    mesh_node.mesh.vertices.set_attribute('TEXCOORD_0', vertices[:, 6:8])
+    mesh_node.mesh.vertices.set_attribute('JOINTS_0',
+                                          vertices[:, 8:12].astype(np.int32))
+    mesh_node.mesh.vertices.set_attribute('WEIGHTS_0', vertices[:, 12:16])
+
+    indices = np.ctypeslib.as_array(pmx.indices)
     for submesh in pmx.submeshes:
         gltf_submesh = gltf.Submesh(offset, submesh.draw_count)
-
-        def indices_gen():
-            while True:
-                try:
-                    i = next(it)
-                    yield i
-                except StopIteration:
-                    break
-
-        gltf_submesh.indices = indices_gen
+        gltf_submesh.indices = indices[offset:offset + submesh.draw_count]
         mesh_node.mesh.submeshes.append(gltf_submesh)
         offset += submesh.draw_count
     mesh_node.skin = gltf.Skin()
     mesh_node.skin.joints = [node for node in loader.nodes]
+    loader.meshes.append(mesh_node.mesh)
     loader.nodes.append(mesh_node)
     loader.roots.append(mesh_node)
 
@@ -139,15 +103,15 @@ class Importer(bpy.types.Operator, ImportHelper):
                                          gltf.Coordinate.BLENDER_ROTATE)
             # print(loaded)
             loader = pmx_to_gltf(pmx)
+            loader.apply_conversion(conversion)
 
         else:
-            loader, conversion = gltf.load(path,
-                                           gltf.Coordinate.BLENDER_ROTATE)
+            loader, _ = gltf.load(path, gltf.Coordinate.BLENDER_ROTATE)
 
         # build mesh
         collection = bpy.data.collections.new(name=path.name)
         context.scene.collection.children.link(collection)
-        bl_importer = blender_scene.Importer(collection, conversion)
+        bl_importer = blender_scene.Importer(collection)
         bl_importer.load(loader)
 
         logger.debug('#### end ####')
@@ -0,0 +1,78 @@
+import unittest
+import math
+import numpy as np
+from humanoidio.gltf import batching, mesh, node, transform
+
+
+def create_quad(material: str) -> mesh.ExportMesh:
+    m = mesh.ExportMesh(4, 6)
+    m.POSITION[:] = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)]
+    m.NORMAL[:] = (0, 0, 1)
+    m.loop_normals[:] = (0, 0, 1)
+    m.indices[:] = [0, 1, 2, 0, 2, 3]
+    m.submeshes = [mesh.ExportSubmesh(material, 0, 6)]
+    return m
+
+
+class TestBatching(unittest.TestCase):
+    def test_trs_to_matrix(self):
+        s = math.sin(math.pi / 4)
+        m = transform.trs_to_matrix([(1, 2, 3)], [(0, 0, s, s)], [(2, 2, 2)])
+        p = transform.transform_points(m[0], np.array([(1, 0, 0)]))
+        self.assertTrue(np.allclose([(1, 4, 3)], p))
+
+    def test_merge(self):
+        root = node.Node('root')
+        a = node.Node('a')
+        a.mesh = create_quad('red')
+        a.translation = (1, 0, 0)
+        b = node.Node('b')
+        b.mesh = create_quad('blue')
+        b.scale = (1, 1, -1)
+        c = node.Node('c')
+        c.mesh = create_quad('red')
+        root.add_child(a)
+        a.add_child(b)
+        root.add_child(c)
+
+        report = batching.merge_static_meshes(root)
+        self.assertEqual((3, 1, 3, 2), report)
+        self.assertIsNone(a.mesh)
+
+        merged = root.mesh
+        self.assertEqual(12, len(merged.POSITION))
+        self.assertEqual([1, 2, 2, 1, 1, 2, 2, 1, 0, 1, 1, 0],
+                         merged.POSITION[:, 0].tolist())
+        # b の normal は scale で反転する
+        self.assertEqual([1, -1, 1], merged.NORMAL[::4, 2].tolist())
+        self.assertEqual([4, 6, 5], merged.indices[12:15].tolist())
+        self.assertEqual([('red', 0, 12), ('blue', 12, 6)], merged.submeshes)
+        self.assertEqual(['a', 'c', 'b'], [s.name for s in merged.sources])
+        self.assertEqual([0, 6, 12],
+                         [s.index_offset for s in merged.sources])
+
+    def test_animated(self):
+        root = node.Node('root')
+        a = node.Node('a')
+        a.mesh = create_quad('red')
+        b = node.Node('b')
+        b.mesh = create_quad('red')
+        c = node.Node('c')
+        c.mesh = create_quad('red')
+        d = node.Node('d')
+        d.mesh = create_quad('red')
+        root.add_child(a)
+        a.add_child(b)
+        root.add_child(c)
+        root.add_child(d)
+
+        # a が動くと子の b も動く
+        report = batching.merge_static_meshes(root, animated=[a, root])
+        self.assertEqual((2, 1, 2, 1), report)
+        self.assertIsNotNone(a.mesh)
+        self.assertIsNotNone(b.mesh)
+        self.assertEqual(['c', 'd'], [s.name for s in root.mesh.sources])
+
+
+if __name__ == '__main__':
+    unittest.main()
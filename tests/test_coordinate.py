@@ -0,0 +1,118 @@
+import unittest
+import numpy as np
+from humanoidio.gltf import transform, loader, mesh, node
+from humanoidio.gltf.coordinate import Coordinate, Conversion
+
+
+class TestCoordinate(unittest.TestCase):
+    def test_vectors(self):
+        v = np.array([(1, 2, 3)], dtype=np.float32)
+        # yup2zup
+        self.assertEqual([[1, -3, 2]],
+                         Conversion(Coordinate.GLTF,
+                                    Coordinate.BLENDER_ROTATE).convert_vectors(
+                                        v).tolist())
+        # yup2zup_turn
+        self.assertEqual([[-1, 3, 2]],
+                         Conversion(Coordinate.VRM0,
+                                    Coordinate.BLENDER_ROTATE).convert_vectors(
+                                        v).tolist())
+        self.assertEqual([[-1, 3, 2]],
+                         Conversion(Coordinate.GLTF,
+                                    Coordinate.BLENDER).convert_vectors(
+                                        v).tolist())
+        self.assertTrue(Conversion(Coordinate.VRM1, Coordinate.GLTF).is_identity)
+
+    def test_mirror(self):
+        conversion = Conversion(Coordinate.GLTF, Coordinate.UNITY)
+        self.assertTrue(conversion.is_mirror)
+        tangent = np.array([(1, 0, 0, 1)], dtype=np.float32)
+        self.assertEqual([[-1, 0, 0, -1]],
+                         conversion.convert_tangents(tangent).tolist())
+        conversion.convert_tangents(tangent, tangent)
+        self.assertEqual([[-1, 0, 0, -1]], tangent.tolist())
+
+    def test_rotation(self):
+        rng = np.random.default_rng(0)
+        q = rng.normal(size=(8, 4))
+        q /= np.linalg.norm(q, axis=1, keepdims=True)
+        r = transform.quaternion_to_matrix(q)
+        for src in Coordinate:
+            for dst in Coordinate:
+                conversion = Conversion(src, dst)
+                m = conversion.matrix
+                converted = transform.quaternion_to_matrix(
+                    conversion.convert_quaternions(q))
+                self.assertTrue(np.allclose(m @ r @ m.T, converted))
+
+                matrices = transform.trs_to_matrix(np.ones((8, 3)), q,
+                                                   np.tile((1, 2, 3), (8, 1)))
+                t, rr, s = conversion.convert_trs(np.ones((8, 3)), q,
+                                                  np.tile((1, 2, 3), (8, 1)))
+                self.assertTrue(
+                    np.allclose(conversion.convert_matrices(matrices),
+                                transform.trs_to_matrix(t, rr, s)))
+
+                # その場で書き換えても同じ
+                trs = (np.ones((8, 3)), q.copy(), np.tile((1.0, 2, 3),
+                                                          (8, 1)))
+                converted = conversion.convert_trs(*trs, inplace=True)
+                for a, b, c in zip(trs, converted, (t, rr, s)):
+                    self.assertIs(a, b)
+                    self.assertTrue(np.allclose(b, c))
+                expected = conversion.convert_matrices(matrices)
+                self.assertIs(matrices,
+                              conversion.convert_matrices(matrices, matrices))
+                self.assertTrue(np.allclose(expected, matrices))
+
+    def test_loader(self):
+        l = loader.Loader()
+        m = mesh.Mesh('mesh')
+        m.vertices = mesh.VertexBuffer()
+        m.vertices.POSITION = np.array([(1, 2, 3)] * 3, dtype=np.float32)
+        sm = mesh.Submesh(0, 3)
+        sm.indices = np.array([0, 1, 2])
+        m.submeshes.append(sm)
+        l.meshes.append(m)
+        n = node.Node('node')
+        n.translation = (1, 2, 3)
+        n.mesh = m
+        l.nodes.append(n)
+        l.roots.append(n)
+
+        l.apply_conversion(Conversion(Coordinate.GLTF, Coordinate.BLENDER))
+        self.assertEqual([-1, 3, 2], m.vertices.POSITION[0].tolist())
+        self.assertEqual((-1, 3, 2), n.translation)
+        self.assertEqual([0, 1, 2], m.get_indices().tolist())
+
+        # mirror なので三角形の向きを反転する
+        l.apply_conversion(Conversion(Coordinate.BLENDER, Coordinate.UNITY))
+        self.assertEqual([-1, 2, 3], m.vertices.POSITION[0].tolist())
+        self.assertEqual([0, 2, 1], m.get_indices().tolist())
+
+    def test_node_mesh(self):
+        # pmx のように mesh を node だけが持っている
+        l = loader.Loader()
+        bone = node.Node('bone')
+        bone.translation = (0, 2, 0)
+        mesh_node = node.Node('__mesh__')
+        mesh_node.mesh = mesh.Mesh('mesh')
+        mesh_node.mesh.vertices = mesh.VertexBuffer()
+        mesh_node.mesh.vertices.POSITION = np.array([(0, 1, 0)] * 3,
+                                                    dtype=np.float32)
+        sm = mesh.Submesh(0, 3)
+        sm.indices = np.array([0, 1, 2])
+        mesh_node.mesh.submeshes.append(sm)
+        l.nodes += [bone, mesh_node]
+        l.roots += [bone, mesh_node]
+
+        l.apply_conversion(
+            Conversion(Coordinate.VRM1, Coordinate.BLENDER_ROTATE))
+        # 頂点と bone が同じ座標系になる
+        self.assertEqual((0, 0, 2), bone.translation)
+        self.assertEqual([0, 0, 1],
+                         mesh_node.mesh.vertices.POSITION[0].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
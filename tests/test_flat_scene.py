@@ -0,0 +1,68 @@
+import unittest
+import math
+import numpy as np
+from humanoidio.gltf import node, flat_scene
+
+
+def create_chain() -> node.Node:
+    s = math.sin(math.pi / 4)
+    root = node.Node('root')
+    root.translation = (1, 0, 0)
+    a = node.Node('a')
+    a.translation = (0, 1, 0)
+    a.rotation = (0, 0, s, s)
+    b = node.Node('b')
+    b.translation = (2, 0, 0)
+    c = node.Node('c')
+    c.scale = (2, 2, 2)
+    d = node.Node('d')
+    d.translation = (0, 0, 1)
+    root.add_child(a)
+    a.add_child(b)
+    root.add_child(c)
+    c.add_child(d)
+    return root
+
+
+class TestFlatScene(unittest.TestCase):
+    def test_order(self):
+        root = create_chain()
+        self.assertEqual(['root', 'a', 'b', 'c', 'd'],
+                         [n.name for n in root.traverse()])
+        scene = flat_scene.FlatScene([root])
+        self.assertEqual(['root', 'a', 'c', 'b', 'd'],
+                         [n.name for n in scene.nodes])
+        self.assertEqual([-1, 0, 0, 1, 2], scene.parents.tolist())
+        self.assertEqual([0, 1, 3, 5], scene.levels)
+
+    def test_world_matrices(self):
+        root = create_chain()
+        scene = flat_scene.FlatScene([root])
+        world = scene.world_matrices()
+        # 親を順にたどって掛けたものと一致する
+        local = node.get_local_matrices(scene.nodes)
+        for i, n in enumerate(scene.nodes):
+            m = np.identity(4)
+            while n:
+                m = local[scene.index_of(n)] @ m
+                n = n.parent
+            self.assertTrue(np.allclose(m, world[i]))
+        b, d = scene.get_matrices([root.children[0].children[0],
+                                   root.children[1].children[0]])
+        self.assertTrue(np.allclose((1, 3, 0), b[:3, 3]))
+        self.assertTrue(np.allclose((1, 0, 2), d[:3, 3]))
+
+    def test_push(self):
+        root = create_chain()
+        scene = flat_scene.FlatScene([root])
+        scene.translation[:, 2] += 1
+        scene.push()
+        self.assertEqual((1, 0, 1), root.translation)
+        self.assertTrue(
+            np.allclose((1, 0, 6),
+                        scene.world_matrices()[scene.index_of(
+                            root.children[1].children[0])][:3, 3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import numpy as np
+from humanoidio.gltf import exporter, geometry, mesh
+
+
+class TestGeometry(unittest.TestCase):
+    def test_normals(self):
+        # 屋根の形
+        positions = np.array([(0, 0, 0), (1, 0, 1), (2, 0, 0), (0, 1, 0),
+                              (1, 1, 1), (2, 1, 0)],
+                             dtype=np.float32)
+        indices = np.array([0, 1, 4, 0, 4, 3, 1, 2, 5, 1, 5, 4])
+        for weighting in ('area', 'angle'):
+            normals = geometry.compute_normals(positions, indices, weighting)
+            self.assertTrue(
+                np.allclose([-np.sqrt(0.5), 0, np.sqrt(0.5)], normals[0]))
+
+        # 稜線の頂点は片側に三角形が 2 つある。角度の重みなら偏らない
+        normals = geometry.compute_normals(positions, indices, 'angle')
+        self.assertTrue(np.allclose([0, 0, 1], normals[1]))
+        normals = geometry.compute_normals(positions, indices, 'area')
+        self.assertGreater(normals[1][0], 0)
+        with self.assertRaises(ValueError):
+            geometry.compute_normals(positions, indices, 'unknown')
+
+    def test_tangents(self):
+        positions = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)],
+                             dtype=np.float32)
+        normals = np.array([(0, 0, 1)] * 4, dtype=np.float32)
+        indices = np.array([0, 1, 2, 0, 2, 3])
+
+        # blender の uv を 1 - v にしたもの。glTF では v が -y 向き
+        uvs = np.array([(0, 1), (1, 1), (1, 0), (0, 0)], dtype=np.float32)
+        tangents = geometry.compute_tangents(positions, normals, uvs, indices)
+        self.assertTrue(np.allclose([(1, 0, 0, 1)] * 4, tangents))
+
+        # u を反転すると tangent と w が反転する
+        mirrored = uvs * (-1, 1)
+        tangents = geometry.compute_tangents(positions, normals, mirrored,
+                                             indices)
+        self.assertTrue(np.allclose([(-1, 0, 0, -1)] * 4, tangents))
+
+        # glTF の uv で v が +y 向きなら裏返し
+        flipped = np.array([(0, 0), (1, 0), (1, 1), (0, 1)],
+                           dtype=np.float32)
+        tangents = geometry.compute_tangents(positions, normals, flipped,
+                                             indices)
+        self.assertTrue(np.allclose([(1, 0, 0, -1)] * 4, tangents))
+        tangents = geometry.compute_tangents(positions, normals,
+                                             flipped * (-1, 1), indices)
+        self.assertTrue(np.allclose([(-1, 0, 0, 1)] * 4, tangents))
+
+    def test_push_mesh_keeps_source(self):
+        # normal / tangent は push_mesh の中だけで作る
+        m = mesh.ExportMesh(4, 6)
+        m.POSITION[:] = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)]
+        m.indices[:] = [0, 1, 2, 0, 2, 3]
+        m.TEXCOORD_0 = np.array([(0, 0), (1, 0), (1, 1), (0, 1)],
+                                dtype=np.float32)
+        writer = exporter.GltfWriter(export_tangents=True, dedup=False)
+        first = writer.push_mesh(m)
+        self.assertFalse(np.any(m.NORMAL))
+        self.assertFalse(np.any(m.loop_normals))
+        self.assertIsNone(m.TANGENT)
+        second = writer.push_mesh(m)
+        self.assertEqual(writer.gltf['meshes'][first]['primitives'][0]
+                         ['attributes'].keys(), writer.gltf['meshes'][second]
+                         ['primitives'][0]['attributes'].keys())
+        self.assertIn('TANGENT', writer.gltf['meshes'][second]['primitives']
+                      [0]['attributes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 import struct
 import array
 import ctypes
+import numpy as np
 from humanoidio.gltf import accessor_util
 
 
@@ -38,6 +39,143 @@ class TestMemoryView(unittest.TestCase):
         self.assertEqual(accessor_util.ComponentType.Float, t)
         self.assertEqual(c, 3)
 
+    def test_accessor_array(self):
+        bin = struct.pack("ffffff", 1, 2, 3, 4, 5, 6)
+        gltf = {
+            'bufferViews': [{
+                'buffer': 0,
+                'byteOffset': 0,
+                'byteLength': len(bin)
+            }],
+            'accessors': [{
+                'bufferView': 0,
+                'componentType': accessor_util.ComponentType.Float.value,
+                'type': 'VEC3',
+                'count': 2
+            }],
+        }
+        data = accessor_util.GltfAccessor(gltf, bin)
+        values = data.accessor_array(0)
+        self.assertEqual((2, 3), values.shape)
+        self.assertFalse(values.flags.writeable)
+        self.assertEqual([4, 5, 6], values[1].tolist())
+        self.assertEqual([(1, 2, 3), (4, 5, 6)],
+                         list(data.accessor_generator(0)()))
+
+    def test_accessor_array_stride(self):
+        # interleaved POSITION, NORMAL
+        bin = struct.pack("ffffff" * 2, 1, 2, 3, 0, 0, 1, 4, 5, 6, 0, 1, 0)
+        gltf = {
+            'bufferViews': [{
+                'buffer': 0,
+                'byteOffset': 0,
+                'byteLength': len(bin),
+                'byteStride': 24,
+            }],
+            'accessors': [{
+                'bufferView': 0,
+                'componentType': accessor_util.ComponentType.Float.value,
+                'type': 'VEC3',
+                'count': 2
+            }, {
+                'bufferView': 0,
+                'byteOffset': 12,
+                'componentType': accessor_util.ComponentType.Float.value,
+                'type': 'VEC3',
+                'count': 2
+            }],
+        }
+        data = accessor_util.GltfAccessor(gltf, bin)
+        self.assertEqual([[1, 2, 3], [4, 5, 6]],
+                         data.accessor_array(0).tolist())
+        self.assertEqual([[0, 0, 1], [0, 1, 0]],
+                         data.accessor_array(1).tolist())
+
+    def test_sparse(self):
+        gltf = {'bufferViews': [], 'accessors': []}
+        data = accessor_util.GltfAccessor(gltf, bytearray())
+        values = np.zeros((100, 3), dtype=np.float32)
+        values[3] = (1, 2, 3)
+        values[70] = (0, -1, 0)
+        index = data.push_array(values, sparse=True)
+        accessor = gltf['accessors'][index]
+        self.assertNotIn('bufferView', accessor)
+        self.assertEqual(2, accessor['sparse']['count'])
+        self.assertTrue(np.array_equal(values, data.accessor_array(index)))
+
+        # all zero
+        index = data.push_array(np.zeros((10, 3), dtype=np.float32),
+                                sparse=True)
+        self.assertNotIn('sparse', gltf['accessors'][index])
+        self.assertEqual((10, 3), data.accessor_array(index).shape)
+
+    def test_dequantize(self):
+        values = np.array([[-32768, 0, 32767]], dtype=np.int16)
+        self.assertEqual([[-1, 0, 1]],
+                         accessor_util.dequantize(values, True).tolist())
+        values = np.array([[0, 255]], dtype=np.uint8)
+        self.assertEqual([[0, 1]],
+                         accessor_util.dequantize(values, True).tolist())
+        self.assertEqual([[0, 255]],
+                         accessor_util.dequantize(values, False).tolist())
+
+    def test_accessor_cache(self):
+        cache = accessor_util.AccessorCache(max_bytes=64)
+        a = cache.get(0, lambda: np.zeros(8, dtype=np.float32))
+        self.assertIs(a, cache.get(0, lambda: np.zeros(8, dtype=np.float32)))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        # 32 + 48 > 64 なので 0 が追い出される
+        cache.get(1, lambda: np.zeros(12, dtype=np.float32))
+        self.assertEqual(1, cache.evictions)
+        self.assertIsNot(a, cache.get(0,
+                                      lambda: np.zeros(8, dtype=np.float32)))
+
+    def test_dedup(self):
+        gltf = {'bufferViews': [], 'accessors': []}
+        data = accessor_util.GltfAccessor(gltf, bytearray(), dedup=True)
+        values = np.arange(12, dtype=np.float32).reshape(4, 3)
+        a = data.push_array(values)
+        self.assertEqual(a, data.push_array(values.copy()))
+        # 同じ bytes でも型が違えば accessor は別。bufferView は共有する
+        b = data.push_array(values.reshape(3, 4))
+        self.assertNotEqual(a, b)
+        self.assertEqual(1, len(gltf['bufferViews']))
+        self.assertEqual(96, data.dedup_bytes)
+
+    def test_buffer_builder(self):
+        from humanoidio.gltf.buffer_builder import BufferBuilder
+        for spill_threshold in (None, 4):
+            bin = BufferBuilder(capacity=16, spill_threshold=spill_threshold)
+            self.assertEqual(0, bin.write(b'abc'))
+            self.assertEqual(4, bin.write(b'de'))
+            self.assertEqual(b'abc\0de', bytes(bin))
+            self.assertEqual(spill_threshold is not None, bin.spilled)
+            bin.close()
+
+        # spill_threshold を超えて確保しない
+        bin = BufferBuilder(spill_threshold=64)
+        bin.reserve(1024 * 1024)
+        self.assertEqual(64, bin.capacity)
+        self.assertEqual(0, bin.write(b'abc'))
+        bin.reserve(128)
+        self.assertEqual(64, bin.capacity)
+        self.assertEqual(b'abc', bytes(bin))
+        bin.close()
+
+    def test_narrow_indices(self):
+        indices = (ctypes.c_uint32 * 3)(0, 1, 254)
+        self.assertEqual(np.uint8,
+                         accessor_util.narrow_indices(indices).dtype)
+        self.assertEqual(
+            np.uint16,
+            accessor_util.narrow_indices(indices, allow_uint8=False).dtype)
+        indices[2] = 255
+        self.assertEqual(np.uint16,
+                         accessor_util.narrow_indices(indices).dtype)
+        indices[2] = 65535
+        self.assertEqual(np.uint32,
+                         accessor_util.narrow_indices(indices).dtype)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,112 @@
+import unittest
+import numpy as np
+from humanoidio.gltf import mesh
+
+
+class TestMesh(unittest.TestCase):
+    def test_vertex_buffer(self):
+        vertices = mesh.VertexBuffer()
+        vertices.set_attribute('POSITION', np.zeros((4, 3), dtype=np.float32))
+        vertices.set_attribute('COLOR_0', np.ones((4, 4), dtype=np.float32))
+        self.assertEqual(4, vertices.vertex_count)
+        self.assertIn('COLOR_0', vertices)
+        self.assertIsNone(vertices.NORMAL)
+        with self.assertRaises(ValueError):
+            vertices.set_attribute('NORMAL', np.zeros((3, 3)))
+
+        sliced = vertices.slice(1, 3)
+        self.assertEqual(2, sliced.vertex_count)
+        self.assertTrue(np.shares_memory(sliced['COLOR_0'],
+                                         vertices['COLOR_0']))
+
+    def test_concat(self):
+        m = mesh.Mesh('mesh')
+        for i, uv in enumerate((True, False)):
+            sm = mesh.Submesh(i * 3, 3)
+            sm.vertex_offset = i * 3
+            sm.vertices = mesh.VertexBuffer()
+            sm.vertices.POSITION = np.full((3, 3), i, dtype=np.float32)
+            if uv:
+                sm.vertices.TEXCOORD_0 = np.ones((3, 2), dtype=np.float32)
+            sm.indices = np.array([[0], [1], [2]], dtype=np.uint16)
+            m.submeshes.append(sm)
+
+        vertices = m.get_vertices()
+        self.assertEqual(6, vertices.vertex_count)
+        self.assertEqual([1, 1, 1, 0, 0, 0], vertices.TEXCOORD_0[:, 0].tolist())
+        self.assertEqual([0, 1, 2, 3, 4, 5], m.get_indices().tolist())
+
+    def test_split(self):
+        # 2 triangles sharing an edge with a hard normal
+        m = mesh.ExportMesh(4, 6)
+        m.POSITION[:] = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)]
+        m.NORMAL[:] = (0, 0, 1)
+        m.indices[:] = [0, 1, 2, 0, 2, 3]
+        m.loop_normals[:3] = (0, 0, 1)
+        m.loop_normals[3:] = (0, 0.001, 1)
+        m.loop_normals[3] = (0, 0, 1)
+        m.normal_splitted = True
+
+        splitted = m.split()
+        self.assertEqual(5, len(splitted.POSITION))
+        self.assertEqual([0, 1, 2, 0, 3, 4], splitted.indices.tolist())
+        self.assertEqual([0, 1, 2, 2, 3], splitted.source_vertices.tolist())
+        self.assertTrue(
+            np.array_equal(splitted.NORMAL[splitted.indices], m.loop_normals))
+
+        # normal の差を無視する
+        welded = m.split(normal_epsilon=0.01)
+        self.assertEqual(4, len(welded.POSITION))
+
+    def test_sort_by_material(self):
+        m = mesh.ExportMesh(4, 9)
+        m.indices[:] = [0, 1, 2, 0, 2, 3, 1, 2, 3]
+        m.loop_normals[:] = np.arange(9).reshape(-1, 1)
+        m.sort_by_material(np.array([1, 0, 1]), ['a', 'b'])
+
+        self.assertEqual([0, 2, 3, 0, 1, 2, 1, 2, 3], m.indices.tolist())
+        self.assertEqual([3, 4, 5, 0, 1, 2, 6, 7, 8],
+                         m.loop_normals[:, 0].tolist())
+        self.assertEqual([('a', 0, 3), ('b', 3, 6)], m.submeshes)
+
+        # submesh は split しても残る
+        self.assertEqual(m.submeshes, m.split().submeshes)
+
+    def test_targets(self):
+        m = mesh.Mesh('mesh')
+        for i in range(2):
+            sm = mesh.Submesh(i * 3, 3)
+            sm.vertices = mesh.VertexBuffer()
+            sm.vertices.POSITION = np.zeros((3, 3), dtype=np.float32)
+            m.submeshes.append(sm)
+        target = mesh.VertexBuffer()
+        target.POSITION = np.ones((3, 3), dtype=np.float32)
+        m.submeshes[1].targets.append(target)
+
+        targets = m.get_targets()
+        self.assertEqual(1, len(targets))
+        self.assertEqual([0, 0, 0, 1, 1, 1], targets[0].POSITION[:, 0].tolist())
+        self.assertEqual('target0', m.get_target_name(0))
+
+    def test_split_targets(self):
+        m = mesh.ExportMesh(4, 6)
+        m.NORMAL[:] = (0, 0, 1)
+        m.indices[:] = [0, 1, 2, 0, 2, 3]
+        m.loop_normals[:] = (0, 0, 1)
+        m.loop_normals[4] = (0, 1, 0)
+        m.targets['a'] = np.arange(12, dtype=np.float32).reshape(4, 3)
+        self.assertEqual([4], np.flatnonzero(m.check_normals()).tolist())
+        self.assertTrue(m.normal_splitted)
+
+        splitted = m.split()
+        self.assertEqual(5, len(splitted.POSITION))
+        self.assertTrue(
+            np.array_equal(splitted.targets['a'],
+                           m.targets['a'][splitted.source_vertices]))
+
+        # normal_epsilon の範囲で同じなら分けない
+        self.assertIs(m, m.split(normal_epsilon=1.0))
+        self.assertFalse(m.normal_splitted)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import numpy as np
+from humanoidio.gltf import exporter, mesh, node, node_index, simplify
+from humanoidio.gltf.humanoid import HumanoidBones
+
+SCALES = np.array([(1, 1, 1), (2, 2, 2)], dtype=np.float32)
+
+
+def create_quad() -> mesh.ExportMesh:
+    m = mesh.ExportMesh(4, 6)
+    m.POSITION[:] = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)]
+    m.NORMAL[:] = (0, 0, 1)
+    m.loop_normals[:] = (0, 0, 1)
+    m.indices[:] = [0, 1, 2, 0, 2, 3]
+    return m
+
+
+class TestNodeIndex(unittest.TestCase):
+    def test_lookup(self):
+        root = node.Node('root')
+        hips = node.Node('hips')
+        hips.humanoid_bone = HumanoidBones.hips
+        root.add_child(hips)
+        index = node_index.NodeIndex.from_roots([root])
+        self.assertEqual(1, index.index_of(hips))
+        self.assertIs(hips, index.get_by_name('hips'))
+        self.assertIs(hips, index.get_humanoid_bone(HumanoidBones.hips))
+        self.assertIsNone(index.get_by_name('spine'))
+
+        index.set_humanoid_bone(root, HumanoidBones.spine)
+        self.assertIs(root, index.get_humanoid_bone(HumanoidBones.spine))
+        self.assertEqual(HumanoidBones.leftHand,
+                         HumanoidBones.from_name('leftHand'))
+        with self.assertRaises(ValueError):
+            HumanoidBones.from_name('tail')
+
+    def test_constraint(self):
+        # LOD の node が間に入るので、書いた順の index を使う
+        root = node.Node('root')
+        a = node.Node('a')
+        a.mesh = create_quad()
+        b = node.Node('b')
+        c = node.Node('c')
+        root.add_child(a)
+        root.add_child(b)
+        b.add_child(c)
+        # まだ書いていない node を参照する
+        a.constraint = node.RotationConstraint(c, 0.5)
+
+        writer = exporter.GltfWriter(lod_levels=[simplify.LodLevel(0.5)])
+        index = node_index.NodeIndex.from_roots([root])
+        writer.push_scene([root], index)
+        gltf_nodes = writer.gltf['nodes']
+        self.assertEqual(['root', 'a', 'a.lod1', 'b', 'c'],
+                         [n['name'] for n in gltf_nodes])
+        self.assertEqual(
+            {'rotation': {
+                'source': 4,
+                'weight': 0.5
+            }}, gltf_nodes[1]['extensions']['VRMC_node_constraint']
+            ['constraint'])
+        self.assertEqual(4, writer.get_node_index(index.index_of(c)))
+        # 書いていない node の animation は書かない
+        writer.push_animation(
+            exporter.Animation('action', index.index_of(c),
+                               exporter.AnimationChannelTargetPath.scale,
+                               [0, 1], SCALES), 1)
+        self.assertEqual(
+            4, writer.gltf['animations'][0]['channels'][0]['target']['node'])
+        with self.assertLogs('humanoidio.gltf.exporter', 'WARNING'):
+            writer.push_animation(
+                exporter.Animation('action', len(index),
+                                   exporter.AnimationChannelTargetPath.scale,
+                                   [0, 1], SCALES), 1)
+        self.assertEqual(1, len(writer.gltf['animations']))
+
+        # node ひとつに複数の extension
+        self.assertEqual(['MSFT_lod', 'VRMC_node_constraint'],
+                         writer._finish()['extensionsUsed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
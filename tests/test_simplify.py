@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+from humanoidio.gltf import exporter, mesh, node, simplify
+
+
+def create_grid(n: int) -> mesh.ExportMesh:
+    xs, ys = np.meshgrid(np.arange(n), np.arange(n))
+    x = xs.reshape(-1)
+    y = ys.reshape(-1)
+    q = (ys[:-1, :-1] * n + xs[:-1, :-1]).reshape(-1)
+    indices = np.stack([q, q + 1, q + n + 1, q, q + n + 1, q + n],
+                       axis=1).reshape(-1)
+    m = mesh.ExportMesh(n * n, len(indices))
+    m.POSITION[:] = np.stack([x, y, np.sin(x * 0.3) * np.cos(y * 0.2)],
+                             axis=1)
+    m.NORMAL[:] = (0, 0, 1)
+    m.indices[:] = indices
+    m.loop_normals[:] = (0, 0, 1)
+    # 左半分と右半分で material を分ける
+    column = np.arange(len(indices) // 3) // 2 % (n - 1)
+    m.sort_by_material(column >= (n - 1) // 2, ['left', 'right'])
+    return m
+
+
+class TestSimplify(unittest.TestCase):
+    def test_simplify(self):
+        m = create_grid(20)
+        triangle_count = len(m.indices) // 3
+        simplified, error = simplify.simplify(m, 0.25)
+        self.assertLessEqual(len(simplified.indices) // 3,
+                             triangle_count // 2)
+        self.assertGreater(error, 0)
+
+        # 境界の頂点は残る
+        position = simplified.POSITION
+        self.assertEqual(20, np.count_nonzero(position[:, 0] == 0))
+
+        # submesh の範囲は詰めなおす
+        submeshes = simplified.submeshes
+        self.assertEqual(['left', 'right'], [sm.material for sm in submeshes])
+        self.assertEqual(len(simplified.indices),
+                         sum(sm.index_count for sm in submeshes))
+        self.assertEqual(submeshes[0].index_count, submeshes[1].index_offset)
+
+        # 裏返った三角形が無い
+        triangles = simplified.indices.reshape(-1, 3).astype(np.int64)
+        normals = simplify._triangle_normals(position.astype(np.float64),
+                                             triangles)
+        self.assertTrue(np.all(normals[:, 2] > 0))
+
+    def test_max_error(self):
+        m = create_grid(20)
+        _, error = simplify.simplify(m, 0.0, max_error=0.01)
+        self.assertLessEqual(error, 0.01)
+
+    def test_msft_lod(self):
+        n = node.Node('grid')
+        n.mesh = create_grid(10)
+        n.translation = (1, 2, 3)
+        n.rotation = (0, 0, 1, 0)
+        n.scale = (2, 2, 2)
+        writer = exporter.GltfWriter(lod_levels=[simplify.LodLevel(0.5)])
+        writer.push_scene([n])
+        gltf_nodes = writer.gltf['nodes']
+        self.assertEqual(2, len(gltf_nodes))
+        self.assertEqual({'ids': [1]}, gltf_nodes[0]['extensions']['MSFT_lod'])
+        self.assertEqual(1, gltf_nodes[1]['mesh'])
+        for k in ('translation', 'rotation', 'scale'):
+            self.assertEqual(gltf_nodes[0][k], gltf_nodes[1][k])
+        self.assertEqual([0], writer.gltf['scenes'][0]['nodes'])
+        self.assertIn('MSFT_lod', writer._finish()['extensionsUsed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
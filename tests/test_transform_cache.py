@@ -0,0 +1,123 @@
+import unittest
+import numpy as np
+from humanoidio.gltf import flat_scene, node, transform_cache
+
+
+def create_chain() -> node.Node:
+    '''
+    root - a - b
+         - c - d
+    '''
+    root = node.Node('root')
+    root.translation = (1, 0, 0)
+    a = node.Node('a')
+    a.translation = (0, 1, 0)
+    b = node.Node('b')
+    b.translation = (0, 2, 0)
+    c = node.Node('c')
+    c.scale = (2, 2, 2)
+    d = node.Node('d')
+    root.add_child(a)
+    a.add_child(b)
+    root.add_child(c)
+    c.add_child(d)
+    return root
+
+
+class TestTransformCache(unittest.TestCase):
+    def test_dirty(self):
+        root = create_chain()
+        a = root.children[0]
+        b = a.children[0]
+        cache = transform_cache.TransformCache()
+
+        nodes, world = cache.get_world_matrices([root])
+        self.assertEqual(5, cache.world_count)
+        self.assertEqual(5, cache.local_count)
+        _, expected = node.get_world_matrices([root])
+        self.assertTrue(np.allclose(expected, world))
+
+        # 変更が無ければ計算しない
+        cache.get_world_matrices([root])
+        self.assertEqual(0, cache.world_count)
+
+        # a と子の b だけ計算しなおす
+        a.translation = (0, 2, 0)
+        nodes, world = cache.get_world_matrices([root])
+        self.assertEqual(2, cache.world_count)
+        self.assertEqual(1, cache.local_count)
+        _, expected = node.get_world_matrices([root])
+        self.assertTrue(np.allclose(expected, world))
+        self.assertTrue(
+            np.allclose((1, 4, 0), world[nodes.index(b)][:3, 3]))
+
+        # 一つだけ問い合わせる
+        b.scale = (2, 2, 2)
+        root.children[1].rotation = (1, 0, 0, 0)
+        self.assertTrue(
+            np.allclose((1, 4, 0), cache.get_world_matrix(b)[:3, 3]))
+        self.assertEqual(1, cache.world_count)
+        cache.get_world_matrices([root])
+        self.assertEqual(2, cache.world_count)
+        self.assertEqual(5, cache.query_count)
+        self.assertEqual(10, cache.total_world_count)
+
+    def test_add_child(self):
+        root = create_chain()
+        cache = transform_cache.TransformCache()
+        cache.get_world_matrices([root])
+        child = node.Node('child')
+        child.translation = (0, 0, 3)
+        root.children[0].children[0].add_child(child)
+        self.assertTrue(
+            np.allclose((1, 3, 3), cache.get_world_matrix(child)[:3, 3]))
+        self.assertEqual(1, cache.world_count)
+
+    def test_random(self):
+        # TRS の変更と、一つだけ / 部分木の問い合わせを混ぜて FlatScene と比べる
+        rng = np.random.default_rng(0)
+        nodes = [node.Node('0')]
+        for i in range(1, 30):
+            n = node.Node(str(i))
+            nodes[int(rng.integers(max(0, i - 4), i))].add_child(n)
+            nodes.append(n)
+        root = nodes[0]
+        cache = transform_cache.TransformCache()
+        for _ in range(200):
+            n = nodes[int(rng.integers(len(nodes)))]
+            op = rng.integers(4)
+            if op == 0:
+                n.translation = tuple(rng.normal(size=3).tolist())
+            elif op == 1:
+                q = rng.normal(size=4)
+                n.rotation = tuple((q / np.linalg.norm(q)).tolist())
+            elif op == 2:
+                expected = flat_scene.FlatScene([root]).get_matrices([n])[0]
+                self.assertTrue(
+                    np.allclose(expected, cache.get_world_matrix(n)))
+            else:
+                subtree, world = cache.get_world_matrices([n])
+                self.assertTrue(
+                    np.allclose(
+                        flat_scene.FlatScene([root]).get_matrices(subtree),
+                        world))
+        _, world = cache.get_world_matrices([root])
+        _, expected = node.get_world_matrices([root])
+        self.assertTrue(np.allclose(expected, world))
+
+    def test_chain(self):
+        nodes = [node.Node(str(i)) for i in range(4)]
+        for parent, child in zip(nodes, nodes[1:]):
+            parent.add_child(child)
+        cache = transform_cache.TransformCache()
+        cache.get_world_matrices([nodes[2]])
+        nodes[2].translation = (1, 0, 0)
+        nodes[0].translation = (0, 1, 0)
+        for i in (1, 0, 2):
+            cache.get_world_matrix(nodes[i])
+        _, world = cache.get_world_matrices([nodes[0]])
+        self.assertTrue(np.allclose((1, 1, 0), world[3][:3, 3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import numpy as np
+from humanoidio.gltf import mesh, vertex_cache
+
+
+def create_shuffled_grid(n: int, seed: int = 0) -> mesh.ExportMesh:
+    '''
+    左右で submesh を分けて、submesh の中の三角形を混ぜた grid
+    '''
+    xs, ys = np.meshgrid(np.arange(n), np.arange(n))
+    q = (ys[:-1, :-1] * n + xs[:-1, :-1]).reshape(-1)
+    triangles = np.stack([q, q + 1, q + n + 1, q, q + n + 1, q + n],
+                         axis=1).reshape(-1, 3)
+    m = mesh.ExportMesh(n * n, len(triangles) * 3)
+    m.POSITION[:, 0] = xs.reshape(-1)
+    m.POSITION[:, 1] = ys.reshape(-1)
+    m.NORMAL[:] = (0, 0, 1)
+    m.loop_normals[:] = (0, 0, 1)
+    left = np.arange(len(triangles)) // 2 % (n - 1) < (n - 1) // 2
+    rng = np.random.default_rng(seed)
+    order = np.concatenate([
+        rng.permutation(np.flatnonzero(left)),
+        rng.permutation(np.flatnonzero(~left))
+    ])
+    m.indices[:] = triangles[order].reshape(-1)
+    count = np.count_nonzero(left) * 3
+    m.submeshes = [
+        mesh.ExportSubmesh('left', 0, count),
+        mesh.ExportSubmesh('right', count, len(m.indices) - count)
+    ]
+    return m
+
+
+def get_triangles(m: mesh.ExportMesh, offset: int, count: int) -> list:
+    '''
+    範囲の三角形を位置で表して並べる。頂点の番号に依らない
+    '''
+    positions = m.POSITION[m.indices[offset:offset + count]].reshape(
+        -1, 3, 3)
+    return sorted(map(lambda t: t.tobytes(), positions))
+
+
+class TestVertexCache(unittest.TestCase):
+    def test_measure(self):
+        self.assertEqual((3.0, 1.0), vertex_cache.measure(np.array([0, 1,
+                                                                   2])))
+        # 前の三角形の頂点は cache に残る
+        self.assertEqual((2.0, 1.0),
+                         vertex_cache.measure(np.array([0, 1, 2, 2, 1, 3])))
+        # cache から追い出された頂点は再び miss になる
+        self.assertEqual((3.0, 1.5),
+                         vertex_cache.measure(np.array(
+                             [0, 1, 2, 3, 4, 5, 0, 1, 2]),
+                                              cache_size=2))
+
+    def test_optimize_vertex_fetch(self):
+        vertices, indices = vertex_cache.optimize_vertex_fetch(
+            np.array([5, 2, 7, 2, 5, 9]))
+        self.assertEqual([5, 2, 7, 9], vertices.tolist())
+        self.assertEqual([0, 1, 2, 1, 0, 3], indices.tolist())
+
+    def test_tipsify(self):
+        m = create_shuffled_grid(8)
+        order = vertex_cache.tipsify(m.indices.astype(np.int64),
+                                     len(m.POSITION))
+        self.assertEqual(list(range(len(m.indices) // 3)),
+                         sorted(order.tolist()))
+
+    def test_optimize(self):
+        m = create_shuffled_grid(16)
+        optimized, report = vertex_cache.optimize(m)
+        self.assertLess(report.acmr_after, report.acmr_before)
+        self.assertEqual(
+            report.acmr_after,
+            vertex_cache.measure(optimized.indices.astype(np.int64))[0])
+
+        # submesh の範囲と、その中の三角形は変わらない
+        self.assertEqual(m.submeshes, optimized.submeshes)
+        for sm in m.submeshes:
+            self.assertEqual(
+                get_triangles(m, sm.index_offset, sm.index_count),
+                get_triangles(optimized, sm.index_offset, sm.index_count))
+
+    def test_optimize_sources(self):
+        # merge した mesh は source の範囲の中で並べ替える
+        m = create_shuffled_grid(10)
+        left, right = m.submeshes
+        half = left.index_count // 6 * 3
+        m.sources = [
+            mesh.ExportSource('a', 'left', 0, half),
+            mesh.ExportSource('b', 'left', half, left.index_count - half),
+            mesh.ExportSource('c', 'right', right.index_offset,
+                              right.index_count),
+        ]
+        optimized, _ = vertex_cache.optimize(m)
+        self.assertEqual(m.sources, optimized.sources)
+        self.assertEqual(m.submeshes, optimized.submeshes)
+        for source in m.sources:
+            self.assertEqual(
+                get_triangles(m, source.index_offset, source.index_count),
+                get_triangles(optimized, source.index_offset,
+                              source.index_count))
+
+
+if __name__ == '__main__':
+    unittest.main()